@@ -0,0 +1,26 @@
+# usage: python3 import_time.py [runs]
+# Measures how long a fresh interpreter takes to import the SDK, and to make the first libmetawear call, which is 
+# when the native library is loaded and the called function's prototype is bound.  The median of the runs is reported.
+from __future__ import print_function
+
+import subprocess
+import sys
+
+runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+_SNIPPETS = [
+    ("python startup", "pass"),
+    ("import mbientlab.metawear", "import mbientlab.metawear"),
+    ("import + first libmetawear call", "from mbientlab.metawear import libmetawear; libmetawear.mbl_mw_memory_free(None)"),
+    ("import + MetaWearUSB.scan", "from mbientlab.metawear import MetaWearUSB; MetaWearUSB.scan()"),
+]
+
+def measure(snippet):
+    # time measured inside the child so process creation is excluded
+    code = "import time; _start = time.perf_counter()\n%s\nprint(time.perf_counter() - _start)" % (snippet)
+    output = subprocess.check_output([sys.executable, "-c", code])
+    return float(output.decode().strip().splitlines()[-1])
+
+for name, snippet in _SNIPPETS:
+    samples = sorted(measure(snippet) for _ in range(runs))
+    print("%-34s median %8.2f ms, min %8.2f ms" % (name, samples[len(samples) // 2] * 1000.0, samples[0] * 1000.0))
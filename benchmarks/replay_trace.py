@@ -0,0 +1,30 @@
+# usage: python3 replay_trace.py [trace] [speed]
+# Plays a trace recorded with MetaWear.start_recording back through the SDK and reports the notification throughput.
+# Omit the speed, or pass 0, to replay as fast as possible.
+from __future__ import print_function
+from mbientlab.metawear import MetaWear
+from mbientlab.metawear.trace import TraceReplay
+
+import sys
+import tempfile
+import time
+
+speed = float(sys.argv[2]) if len(sys.argv) > 2 and float(sys.argv[2]) > 0 else None
+replay = TraceReplay(sys.argv[1], speed = speed)
+print("Replaying %d notifications recorded from %s" % (len(replay._notifications), replay.address))
+
+d = MetaWear(replay.address, transport = replay, cache_path = tempfile.mkdtemp(), deserialize = False)
+
+start = time.time()
+d.connect(serialize = False)
+print("SDK initialized in %.3fs" % (time.time() - start))
+
+while not replay.finished:
+    time.sleep(0.01)
+# let the delivery thread flush what has been released
+while len(replay._pending):
+    time.sleep(0.01)
+elapsed = time.time() - start
+
+print("%d notifications in %.3fs -> %.0f notifications/s" % (len(replay._notifications), elapsed, len(replay._notifications) / elapsed))
+d.disconnect()
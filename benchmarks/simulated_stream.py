@@ -0,0 +1,49 @@
+# usage: python3 simulated_stream.py [boards] [seconds] [rate]
+# Streams accelerometer data from simulated boards through the full SDK stack and reports the sample rate
+# received on the host.  A rate of 0 streams as fast as possible.
+from __future__ import print_function
+from mbientlab.metawear import MetaWear, libmetawear
+from mbientlab.metawear.cbindings import *
+from mbientlab.metawear.simulator import MetaWearSimulator
+
+import sys
+import tempfile
+import time
+
+boards = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+class State:
+    def __init__(self, device):
+        self.device = device
+        self.samples = 0
+        self.callback = FnVoid_VoidP_DataP(self.data_handler)
+
+    def data_handler(self, ctx, data):
+        self.samples += 1
+
+cache = tempfile.mkdtemp()
+states = []
+for i in range(boards):
+    sim = MetaWearSimulator("F0:00:00:00:00:%02X" % (i), rates = { 'acc': rate if rate > 0 else None })
+    d = MetaWear(sim.address, transport = sim, cache_path = cache, deserialize = False)
+    d.connect(serialize = False)
+    states.append(State(d))
+
+for s in states:
+    signal = libmetawear.mbl_mw_acc_get_acceleration_data_signal(s.device.board)
+    libmetawear.mbl_mw_datasignal_subscribe(signal, None, s.callback)
+    libmetawear.mbl_mw_acc_enable_acceleration_sampling(s.device.board)
+    libmetawear.mbl_mw_acc_start(s.device.board)
+
+start = time.time()
+time.sleep(seconds)
+elapsed = time.time() - start
+
+for s in states:
+    libmetawear.mbl_mw_acc_stop(s.device.board)
+    s.device.disconnect()
+
+total = sum(s.samples for s in states)
+print("%d boards, %d samples in %.2fs -> %.0f samples/s" % (boards, total, elapsed, total / elapsed))
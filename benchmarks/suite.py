@@ -0,0 +1,444 @@
+# usage: python3 suite.py [--filter substr] [--repeat n] [--trace usb_capture] [--gatt-trace trace] [--save name] [--compare name] [--threshold pct]
+# Times the Python / C bridge hot paths and optionally stores or compares against named baselines in benchmarks/baselines.
+# A regression larger than the threshold (default 10%) against the compared baseline makes the script exit with status 1.
+# Each baseline stores the machine, Python, and revision it was measured on, and timings only compare on similar hardware.  
+# For your own changes, save a baseline from the revision to compare against, e.g. 'python3 suite.py --save main' on the 
+# main branch, then run 'python3 suite.py --compare main'.  The shipped xeon-1cpu-py3.11 baseline is a reference point taken
+# on a single core Xeon VM with CPython 3.11 and libmetawear 0.20.7.  Entries whose setup needs libmetawear are skipped if it cannot be loaded.
+# Entries tagged [legacy] or [copy] time the code paths the current implementations replaced, for reference.
+# The usb_read entries need a pseudo terminal, so only run on POSIX systems; usb_read_idle_cpu reports the cpu time the read 
+# thread uses per second of silence rather than wall time.
+from __future__ import print_function
+from ctypes import *
+from mbientlab.metawear import MetaWear, MetaWearUSB, QueuedDataHandler, SampleSink, parse_value, _value_types
+from mbientlab.metawear.cbindings import *
+from mbientlab.metawear.metawear import _ValueBuffer, _array_to_buffer, _read_state_cache, _write_state_cache
+from mbientlab.metawear.simulator import VirtualConnection
+from mbientlab.metawear.trace import TraceReader, TraceWriter
+
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_benchmarks = []
+
+def benchmark(name, clock = time.perf_counter):
+    """
+    Registers a function returning (operations, run) or (operations, run, cleanup) where run() performs the operations once.  
+    The clock measures each run, use time.process_time to report cpu time rather than wall time
+    """
+    def register(fn):
+        _benchmarks.append((name, fn, clock))
+        return fn
+    return register
+
+def _synthetic_usb_capture(n_frames):
+    random.seed(0)
+    capture = bytearray()
+    for i in range(n_frames):
+        payload = (b'\x03\x1c' if i % 2 == 0 else b'\x13\x07') + struct.pack('<9h', *[random.randint(-32768, 32767) for _ in range(9)])
+        capture += MetaWearUSB.SERIAL_BYTE_START + bytes([len(payload)]) + payload + MetaWearUSB.SERIAL_BYTE_STOP
+    return bytes(capture)
+
+def _data_pointer(type_id, value):
+    # keep the value alive alongside the Data struct
+    data = Data(epoch = 0, value = cast(pointer(value), c_void_p), type_id = type_id, length = sizeof(value))
+    data._value = value
+    return pointer(data)
+
+class _NullConnection(VirtualConnection):
+    def __init__(self):
+        VirtualConnection.__init__(self, "F0:00:00:00:00:00", {})
+
+    def _write(self, value, handler):
+        handler(None)
+
+def _notification_packets(args):
+    """Notification payloads from the recorded GATT trace if one is given, otherwise random 20 byte packets"""
+    if args.gatt_trace is None:
+        return [bytes(random.randrange(256) for _ in range(20)) for _ in range(64)] * 1000
+
+    packets = [value for elapsed, kind, uuid, value in TraceReader(args.gatt_trace) if kind == TraceWriter.NOTIFY]
+    if len(packets) == 0:
+        raise ValueError("No notifications in '%s'" % (args.gatt_trace))
+    # short traces are repeated so each run lasts long enough to time
+    return packets * max(1, 64000 // len(packets))
+
+@benchmark("notification_ingress")
+def notification_ingress(args):
+    # same signature libmetawear hands to enable_notifications, so the callback cost is included
+    handler = FnInt_VoidP_UByteP_UByte(lambda caller, value, length: 0)
+    buffer = _ValueBuffer()
+    packets = _notification_packets(args)
+    def run():
+        for p in packets:
+            handler(None, buffer.load(p), len(p))
+    return len(packets), run
+
+@benchmark("notification_ingress[copy]")
+def notification_ingress_copy(args):
+    handler = FnInt_VoidP_UByteP_UByte(lambda caller, value, length: 0)
+    packets = _notification_packets(args)
+    def run():
+        for p in packets:
+            handler(None, cast(_array_to_buffer(p), POINTER(c_ubyte)), len(p))
+    return len(packets), run
+
+class _LegacyDecoder(object):
+    """Per byte decoder used by MetaWearUSB prior to the buffered frame decoder"""
+    def __init__(self):
+        self._cmd_started = False
+
+    def _bin_cmd_decode(self, c):
+        if self._cmd_started:
+            if self._cmd_len == 0:
+                self._cmd_len = ord(c)
+            elif self._cmd_recv_len < self._cmd_len:
+                self._cmd_recv_len += 1
+                self._cmd_buffer += c
+            elif c == MetaWearUSB.SERIAL_BYTE_STOP:
+                self._cmd_started = False
+                return self._cmd_buffer
+        elif c == MetaWearUSB.SERIAL_BYTE_START:
+            self._cmd_started = True
+            self._cmd_len = 0
+            self._cmd_recv_len = 0
+            self._cmd_buffer = []
+        return []
+
+    def _decode_frames(self, line_bytes):
+        frames = []
+        for i in range(len(line_bytes)):
+            cmd = self._bin_cmd_decode(line_bytes[i:i+1])
+            if len(cmd) > 0:
+                frames.append(cmd)
+        return frames
+
+def _usb_decode_benchmark(create_decoder):
+    def create(args):
+        if args.trace is not None:
+            with open(args.trace, "rb") as f:
+                capture = f.read()
+        else:
+            capture = _synthetic_usb_capture(50000)
+        reads = [capture[i:i + MetaWearUSB.SERIAL_XFER_SIZE] for i in range(0, len(capture), MetaWearUSB.SERIAL_XFER_SIZE)]
+        decoder = create_decoder()
+        def run():
+            for r in reads:
+                decoder._decode_frames(r)
+        return len(capture), run
+    return create
+
+benchmark("usb_decode_frames")(_usb_decode_benchmark(lambda: MetaWearUSB("00:00:00:00:00:00")))
+benchmark("usb_decode_frames[legacy]")(_usb_decode_benchmark(_LegacyDecoder))
+
+class _NullSerial(object):
+    # reports closed so MetaWearUSB does not try to disconnect it when collected
+    is_open = False
+
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return len(data)
+
+    def flush(self):
+        pass
+
+@benchmark("usb_write_batch")
+def usb_write_batch(args):
+    usb = MetaWearUSB("00:00:00:00:00:00")
+    usb.ser = _NullSerial()
+    commands = [bytes(bytearray([0x03, 0x03]) + bytearray(range(i % 16))) for i in range(256)]
+    noop = lambda err: None
+    def run():
+        for i in range(40):
+            for c in commands:
+                usb._write_async(c, noop)
+            entries = list(usb._write_queue)
+            usb._write_queue.clear()
+            usb._write_batch(entries)
+    return 40 * len(commands), run
+
+@benchmark("write_gatt_char_queue")
+def write_gatt_char_queue(args):
+    cache = tempfile.mkdtemp()
+    conn = _NullConnection()
+    device = MetaWear(conn.address, transport = conn, cache_path = cache, deserialize = False)
+    device.conn = conn
+    shutil.rmtree(cache)
+
+    gatt_char = GattChar(service_uuid_high = 0x326a900085cb9195, service_uuid_low = 0xd9dd464cfbbae75a, 
+            uuid_high = 0x326a900185cb9195, uuid_low = 0xd9dd464cfbbae75a)
+    gatt_ptr = pointer(gatt_char)
+    command = (c_ubyte * 18)(*range(18))
+    value = cast(command, POINTER(c_ubyte))
+    def run():
+        for i in range(10000):
+            device._write_gatt_char(None, None, GattCharWriteType.WITHOUT_RESPONSE, gatt_ptr, value, 18)
+    return 10000, run
+
+def _legacy_parse_value(pointer):
+    """parse_value prior to the precompiled decoders, followed by the deepcopy needed to keep the value"""
+    if (pointer.contents.type_id == DataTypeId.BYTE_ARRAY):
+        array_ptr= cast(pointer.contents.value, POINTER(c_ubyte * pointer.contents.length))
+        return [array_ptr.contents[i] for i in range(0, pointer.contents.length)]
+    value_type = _value_types[pointer.contents.type_id]
+    value = cast(pointer.contents.value, POINTER(value_type)).contents
+    return value.value if not hasattr(value_type, '_fields_') else copy.deepcopy(value)
+
+def _parse_value_benchmark(type_id, value_type, parse):
+    def create(args):
+        p = _data_pointer(type_id, value_type())
+        def run():
+            for i in range(10000):
+                parse(p)
+        return 10000, run
+    return create
+
+_names = dict((v, k) for k, v in vars(DataTypeId).items() if not k.startswith('_'))
+_parse_value_types = list(_value_types.items()) + [(DataTypeId.BYTE_ARRAY, c_ubyte * 16)]
+for type_id, value_type in _parse_value_types:
+    for mode, parse in [("", parse_value), (",as_tuple", lambda p: parse_value(p, as_tuple = True)), (",legacy", _legacy_parse_value)]:
+        benchmark("parse_value[%s%s]" % (_names.get(type_id, type_id), mode))(_parse_value_benchmark(type_id, value_type, parse))
+
+_STATE_INFO = {'hardware': '0.4', 'manufacturer': 'MbientLab Inc', 'serial': '044D44', 'model': '8', 'firmware': '1.7.3'}
+
+@benchmark("state_cache_write_read")
+def state_cache_write_read(args):
+    root = tempfile.mkdtemp()
+    state = bytes(random.randrange(256) for _ in range(8192))
+    paths = [os.path.join(root, "%012X.mwc" % (i)) for i in range(100)]
+    def run():
+        for p in paths:
+            _write_state_cache(p, _STATE_INFO, state)
+        for p in paths:
+            _read_state_cache(p)
+    return len(paths), run, lambda: shutil.rmtree(root)
+
+@benchmark("state_cache_load")
+def state_cache_load(args):
+    root = tempfile.mkdtemp()
+    paths = [os.path.join(root, "%012X.mwc" % (i)) for i in range(300)]
+    for p in paths:
+        _write_state_cache(p, _STATE_INFO, bytes(random.randrange(256) for _ in range(8192)))
+    def run():
+        for p in paths:
+            info, content, offset, length = _read_state_cache(p)
+            content[offset:offset + length]
+    return len(paths), run, lambda: shutil.rmtree(root)
+
+@benchmark("state_cache_load[legacy]")
+def state_cache_load_legacy(args):
+    # json files written by serialize prior to the binary cache
+    root = tempfile.mkdtemp()
+    paths = [os.path.join(root, "%012X.json" % (i)) for i in range(300)]
+    for p in paths:
+        with open(p, "w") as f:
+            f.write(json.dumps({"info": _STATE_INFO, "cpp_state": list(bytes(random.randrange(256) for _ in range(8192)))}, indent=2))
+    def run():
+        for p in paths:
+            with open(p, "r") as f:
+                bytearray(json.loads(f.read())["cpp_state"])
+    return len(paths), run, lambda: shutil.rmtree(root)
+
+@benchmark("multi_board_fan_in")
+def multi_board_fan_in(args):
+    boards = 8
+    per_board = 5000
+    def run():
+        received = [0]
+        def handler(epoch, value):
+            received[0] += 1
+        queued = QueuedDataHandler(handler, capacity = 4096)
+        def board():
+            p = _data_pointer(DataTypeId.CARTESIAN_FLOAT, CartesianFloat(1.0, 2.0, 3.0))
+            for i in range(per_board):
+                queued.callback(None, p)
+        threads = [threading.Thread(target=board) for i in range(boards)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        queued.close()
+    return boards * per_board, run
+
+@benchmark("sample_sink_ingress")
+def sample_sink_ingress(args):
+    p = _data_pointer(DataTypeId.CARTESIAN_FLOAT, CartesianFloat(1.0, 2.0, 3.0))
+    sink = SampleSink(capacity = 1 << 16)
+    def run():
+        for i in range(10000):
+            sink.callback(None, p)
+        sink.drain()
+    return 10000, run
+
+class _PollingUSB(MetaWearUSB):
+    """Reads by polling in_waiting, which is what the read poller falls back to without a file descriptor, e.g. on Windows"""
+    def _read_chunk(self, fd):
+        return MetaWearUSB._read_chunk(self, None)
+
+def _pty_usb(usb_type):
+    """Connects a MetaWearUSB object's read poller to a pseudo terminal standing in for the board's serial port"""
+    import pty
+    import serial
+    import tty
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    usb = usb_type("00:00:00:00:00:00")
+    usb.ser = serial.Serial(os.ttyname(slave), 1000000, timeout = .1)
+    usb._write_poll = False
+    usb._read_poll = True
+
+    def cleanup():
+        usb.disconnect()
+        os.close(master)
+        os.close(slave)
+    return usb, master, cleanup
+
+def _usb_read_benchmark(usb_type):
+    """Streams notifications through the read poller as fast as possible"""
+    def create(args):
+        usb, master, cleanup = _pty_usb(usb_type)
+        payload = b'\x03\x04' + struct.pack('<3h', 1, 2, 3)
+        frames = (MetaWearUSB.SERIAL_BYTE_START + bytes([len(payload)]) + payload + MetaWearUSB.SERIAL_BYTE_STOP) * 64
+        writes = 320
+        count = writes * 64
+
+        state = { 'received': 0 }
+        done = threading.Event()
+        def handler(value):
+            state['received'] += 1
+            if state['received'] >= count:
+                done.set()
+        usb.on_notification_received(handler)
+        usb._read_thread = threading.Thread(target = usb._read_poller, daemon = True)
+        usb._read_thread.start()
+
+        def run():
+            state['received'] = 0
+            done.clear()
+            for i in range(writes):
+                os.write(master, frames)
+            done.wait(30.0)
+        return count, run, cleanup
+    return create
+
+def _usb_idle_benchmark(usb_type):
+    """Cpu time the read poller uses per second while the port is silent"""
+    def create(args):
+        usb, master, cleanup = _pty_usb(usb_type)
+        usb._read_thread = threading.Thread(target = usb._read_poller, daemon = True)
+        usb._read_thread.start()
+        return 1, lambda: time.sleep(1.0), cleanup
+    return create
+
+if os.name == 'posix':
+    benchmark("usb_read_poller")(_usb_read_benchmark(MetaWearUSB))
+    benchmark("usb_read_poller[polling]")(_usb_read_benchmark(_PollingUSB))
+    benchmark("usb_read_idle_cpu", clock = time.process_time)(_usb_idle_benchmark(MetaWearUSB))
+    benchmark("usb_read_idle_cpu[polling]", clock = time.process_time)(_usb_idle_benchmark(_PollingUSB))
+
+def _baseline_path(name):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "%s.json" % (name))
+
+def _environment(args):
+    """Describes where the results were measured, stored with each baseline"""
+    processor = platform.processor()
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            processor = next(l.split(':', 1)[1].strip() for l in f if l.startswith("model name"))
+    except (IOError, StopIteration):
+        pass
+    try:
+        revision = subprocess.check_output(["git", "describe", "--always", "--dirty"], cwd = os.path.dirname(os.path.abspath(__file__)), 
+                stderr = subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "python": "%s %s" % (platform.python_implementation(), platform.python_version()),
+        "machine": platform.machine(),
+        "processor": processor,
+        "cpus": os.cpu_count(),
+        "system": platform.platform(),
+        "revision": revision,
+        "gatt_trace": os.path.basename(args.gatt_trace) if args.gatt_trace is not None else None,
+        "usb_trace": os.path.basename(args.trace) if args.trace is not None else None
+    }
+
+parser = argparse.ArgumentParser(description = "MetaWear Python SDK hot path benchmarks")
+parser.add_argument('--filter', help = "Only run benchmarks whose name contains this string")
+parser.add_argument('--repeat', type = int, default = 5, help = "Number of timed runs per benchmark, the fastest is reported")
+parser.add_argument('--trace', help = "Raw USB serial capture to replay through the frame decoder")
+parser.add_argument('--gatt-trace', help = "Trace recorded with MetaWear.start_recording whose notifications feed the notification ingress entries")
+parser.add_argument('--save', help = "Store the results as a named baseline, e.g. the release version")
+parser.add_argument('--compare', help = "Compare the results against a named baseline")
+parser.add_argument('--threshold', type = float, default = 10.0, help = "Percent slowdown reported as a regression")
+args = parser.parse_args()
+
+random.seed(0)
+results = {}
+print("%-48s %14s" % ("benchmark", "ns/op"))
+for name, create, clock in _benchmarks:
+    if args.filter is not None and args.filter not in name:
+        continue
+    try:
+        created = create(args)
+    except OSError as err:
+        # libmetawear, or the pseudo terminal, is not available
+        print("%-48s %14s (%s)" % (name, "skipped", err))
+        continue
+    ops, run = created[0], created[1]
+    try:
+        run()
+        best = None
+        for i in range(args.repeat):
+            start = clock()
+            run()
+            elapsed = clock() - start
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if len(created) > 2:
+            created[2]()
+    results[name] = best * 1e9 / ops
+    print("%-48s %14.1f" % (name, results[name]))
+
+regressions = []
+if args.compare is not None:
+    with open(_baseline_path(args.compare), "r") as f:
+        baseline = json.load(f)
+    print("\nBaseline '%s' was measured on %s" % (args.compare, ', '.join("%s: %s" % (k, v) for k, v in sorted(baseline['environment'].items()))))
+    print("\n%-48s %14s %14s %9s" % ("benchmark", args.compare, "current", "change"))
+    for name, value in sorted(results.items()):
+        if name in baseline['results']:
+            change = (value - baseline['results'][name]) * 100.0 / baseline['results'][name]
+            print("%-48s %14.1f %14.1f %+8.1f%%" % (name, baseline['results'][name], value, change))
+            if change > args.threshold:
+                regressions.append(name)
+
+if args.save is not None:
+    path = _baseline_path(args.save)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(json.dumps({
+            "environment": _environment(args),
+            "results": results
+        }, indent=2, sort_keys=True))
+    print("\nSaved baseline to %s" % (path))
+
+if len(regressions):
+    print("\nRegressions: %s" % (', '.join(regressions)))
+    sys.exit(1)
@@ -35,8 +35,7 @@ class DataHandler:
         self.data_handler_fn = FnVoid_VoidP_DataP(lambda ctx, ptr: print({"identifier": self.identifier, "epoch": ptr.contents.epoch, "value": parse_value(ptr)}))
 
 # setup ble
-libmetawear.mbl_mw_settings_set_connection_parameters(metawear.board, 7.5, 7.5, 0, 6000)
-sleep(1.0)
+metawear.set_connection_profile("download")
 
 # create anonymous signal
 print("Creating anonymous signals")
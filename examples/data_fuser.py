@@ -21,8 +21,7 @@ class State:
     # setup
     def setup(self):
         # ble settings
-        libmetawear.mbl_mw_settings_set_connection_parameters(self.device.board, 7.5, 7.5, 0, 6000)
-        sleep(1.5)
+        self.device.set_connection_profile("stream", settle = 1.5)
         # events
         e = Event()
         # processor callback fxn
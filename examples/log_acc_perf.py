@@ -42,8 +42,7 @@ try:
     libmetawear.mbl_mw_logging_flush_page(d.board)
     
     print("Downloading data")
-    libmetawear.mbl_mw_settings_set_connection_parameters(d.board, 7.5, 7.5, 0, 6000)
-    time.sleep(1.0)
+    d.set_connection_profile("download")
 
     print("Setup Download handler")
     e = Event()
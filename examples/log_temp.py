@@ -55,10 +55,7 @@ try:
     libmetawear.mbl_mw_logging_flush_page(d.board)
     
     # setup ble
-    libmetawear.mbl_mw_settings_set_connection_parameters(d.board, 7.5, 7.5, 0, 6000)
-    
-    # wait 1s
-    sleep(1.0)
+    d.set_connection_profile("download")
     print("Downloading data")
     
     # setup all items for downloading data
@@ -52,8 +52,7 @@ for s in states:
 
     # ble config
     print("Configuring device")
-    libmetawear.mbl_mw_settings_set_connection_parameters(s.device.board, 7.5, 7.5, 0, 6000)
-    sleep(1.5)
+    s.device.set_connection_profile("download", settle = 1.5)
     
     # setup accelerometer 
     libmetawear.mbl_mw_acc_set_range(s.device.board, 16.0)
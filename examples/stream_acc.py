@@ -34,8 +34,7 @@ for i in range(len(sys.argv) - 1):
 for s in states:
     print("Configuring device")
     # setup ble
-    libmetawear.mbl_mw_settings_set_connection_parameters(s.device.board, 7.5, 7.5, 0, 6000)
-    sleep(1.5)
+    s.device.set_connection_profile("stream", settle = 1.5)
     # setup acc
     libmetawear.mbl_mw_acc_set_odr(s.device.board, 100.0)
     libmetawear.mbl_mw_acc_set_range(s.device.board, 16.0)
@@ -1,6 +1,6 @@
 # usage: python3 stream_acc_packed.py [mac1] [mac2] ... [mac(n)]
 from __future__ import print_function
-from mbientlab.metawear import MetaWear, libmetawear, parse_value
+from mbientlab.metawear import MetaWearSession, libmetawear, parse_value
 from mbientlab.metawear.cbindings import *
 from time import sleep
 from threading import Event
@@ -24,27 +24,29 @@ class State:
         print("ACC: %s -> epoch: %s, data: %s" % (self.device.address, data.contents.epoch, values))
         self.samples+= 1
 
-states = []
-
-# connect
-for i in range(len(sys.argv) - 1):
-    d = MetaWear(sys.argv[i + 1])
-    d.connect()
-    print("Connected to " + d.address + " over " + ("USB" if d.usb.is_connected else "BLE"))
-    states.append(State(d))
-
 # configure
-for s in states:
-    print("Configuring device")
-    libmetawear.mbl_mw_settings_set_connection_parameters(s.device.board, 7.5, 7.5, 0, 6000)
-    sleep(1.5)
+def configure(device):
+    device.set_connection_profile("stream", settle = 1.5)
 
     # setup acc
-    libmetawear.mbl_mw_acc_bmi270_set_odr(s.device.board, AccBmi270Odr._50Hz)
-    #libmetawear.mbl_mw_acc_bmi160_set_odr(s.device.board, AccBmi160Odr._50Hz)
-    libmetawear.mbl_mw_acc_bosch_set_range(s.device.board, AccBoschRange._4G)
-    libmetawear.mbl_mw_acc_write_acceleration_config(s.device.board)
+    libmetawear.mbl_mw_acc_bmi270_set_odr(device.board, AccBmi270Odr._50Hz)
+    #libmetawear.mbl_mw_acc_bmi160_set_odr(device.board, AccBmi160Odr._50Hz)
+    libmetawear.mbl_mw_acc_bosch_set_range(device.board, AccBoschRange._4G)
+    libmetawear.mbl_mw_acc_write_acceleration_config(device.board)
 
+# connect and configure all boards in parallel
+session = MetaWearSession(sys.argv[1:])
+for r in session.connect(configure = configure):
+    if r.error is not None:
+        print("Failed to set up %s after %d attempts: %s" % (r.address, r.attempts, r.error))
+    else:
+        print("Connected to %s over %s (connect: %.2fs, configure: %.2fs)" % (r.address, "USB" if r.device.usb.is_connected else "BLE", 
+            r.timings['connect'], r.timings['configure']))
+
+states = [State(d) for d in session.devices]
+
+# start
+for s in states:
     # get acc and subscribe
     acc = libmetawear.mbl_mw_acc_get_packed_acceleration_data_signal(s.device.board)
     libmetawear.mbl_mw_datasignal_subscribe(acc, None, s.accCallback)
@@ -0,0 +1,39 @@
+# usage: python3 stream_acc_sharded.py [mac1] [mac2] ... [mac(n)]
+from __future__ import print_function
+from mbientlab.metawear import libmetawear
+from mbientlab.metawear.cbindings import *
+from mbientlab.metawear.shard import ShardedSession
+from time import sleep
+
+import sys
+
+# runs in the worker process that owns the board
+def configure(device):
+    device.set_connection_profile("stream")
+
+    libmetawear.mbl_mw_acc_set_odr(device.board, 100.0)
+    libmetawear.mbl_mw_acc_bosch_set_range(device.board, AccBoschRange._4G)
+    libmetawear.mbl_mw_acc_write_acceleration_config(device.board)
+    return [("acc", libmetawear.mbl_mw_acc_get_acceleration_data_signal(device.board))]
+
+# runs once the acc signal is subscribed to, so the first samples are not lost
+def start(device):
+    libmetawear.mbl_mw_acc_enable_acceleration_sampling(device.board)
+    libmetawear.mbl_mw_acc_start(device.board)
+
+if __name__ == "__main__":
+    samples = {}
+    def handler(address, name, epoch, values):
+        samples[address] = samples.get(address, 0) + 1
+
+    # one worker per cpu core, add hci_macs = [...] to give each worker its own adapter
+    session = ShardedSession(sys.argv[1:], configure, start_sampling = start)
+    for r in session.start(handler):
+        print("%s -> worker: %d, error: %s" % (r.address, r.worker, r.error))
+
+    sleep(10.0)
+    session.stop()
+
+    for address, count in samples.items():
+        print("%s -> %d samples" % (address, count))
+    print("dropped: %d" % (session.dropped))
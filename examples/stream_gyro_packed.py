@@ -37,8 +37,7 @@ for i in range(len(sys.argv) - 1):
 # configure
 for s in states:
     print("Configuring device")
-    libmetawear.mbl_mw_settings_set_connection_parameters(s.device.board, 7.5, 7.5, 0, 6000)
-    sleep(1.5)
+    s.device.set_connection_profile("stream", settle = 1.5)
     
     # setup gyro
     print("Configuring acc")
@@ -0,0 +1,13 @@
+# usage: python3 update_fleet.py [mac1] [mac2] ... [mac(n)]
+from __future__ import print_function
+from mbientlab.metawear.dfu import FirmwareRollout
+from mbientlab.metawear.firmware import FirmwareCache
+
+import sys
+
+def wave_finished(index, results):
+    print("wave %d: %s" % (index, ", ".join("%s %s" % (r.address, r.status) for r in results)))
+
+rollout = FirmwareRollout(sys.argv[1:], firmware_cache = FirmwareCache(".metawear/firmware"), wave_size = 8, max_parallel = 4, retries = 2)
+for r in rollout.run(wave_handler = wave_finished):
+    print("%s: %s (%s -> %s)%s" % (r.address, r.status, r.installed, r.firmware, "" if r.error is None else ", " + str(r.error)))
@@ -1,8 +1,12 @@
 from .cbindings import *
+from array import typecodes
 from ctypes import CDLL
+from threading import Lock
+from types import SimpleNamespace
 
 import os
 import platform
+import struct
 
 if (platform.system() == 'Windows'):
     _so_path = os.path.join(os.path.dirname(__file__), 'MetaWear.Win32.dll')
@@ -11,53 +15,142 @@ elif (platform.system() == 'Linux'):
 else:
     raise RuntimeError("MetaWear Python SDK is not supported for '%s'" % platform.system())
 
-libmetawear= CDLL(_so_path)
-init_libmetawear(libmetawear)
+class _PrototypeRecorder(object):
+    """Stands in for the library while init_libmetawear runs, recording the restype and argtypes set on each function"""
+    def __init__(self):
+        self.prototypes = {}
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self.prototypes.setdefault(name, SimpleNamespace())
+
+class _LazyLibrary(object):
+    """
+    Defers loading libmetawear until a function is first used, then binds the ctypes prototype of each function as it 
+    is first looked up instead of binding every function up front
+    """
+    def __init__(self, path):
+        self._path = path
+        self._lib = None
+        self._prototypes = None
+        self._lock = Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._lib is None:
+                recorder = _PrototypeRecorder()
+                init_libmetawear(recorder)
+                self._prototypes = recorder.prototypes
+                self._lib = CDLL(self._path)
+        return self._lib
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        lib = self._lib if self._lib is not None else self._load()
+        fn = getattr(lib, name)
+        if name in self._prototypes:
+            for attr, value in vars(self._prototypes[name]).items():
+                setattr(fn, attr, value)
+        # cache the bound function so later lookups skip __getattr__
+        setattr(self, name, fn)
+        return fn
+
+libmetawear= _LazyLibrary(_so_path)
 
 from .metawear import MetaWear
 from .metawear import MetaWearUSB
+from .session import MetaWearSession
 
-_value_parsers = {
-    DataTypeId.UINT32: lambda p: cast(p.contents.value, POINTER(c_uint)).contents.value,
-    DataTypeId.INT32: lambda p: cast(p.contents.value, POINTER(c_int)).contents.value,
-    DataTypeId.FLOAT: lambda p: cast(p.contents.value, POINTER(c_float)).contents.value,
-    DataTypeId.CARTESIAN_FLOAT: lambda p: cast(p.contents.value, POINTER(CartesianFloat)).contents,
-    DataTypeId.BATTERY_STATE: lambda p: cast(p.contents.value, POINTER(BatteryState)).contents,
-    DataTypeId.TCS34725_ADC: lambda p: cast(p.contents.value, POINTER(Tcs34725ColorAdc)).contents,
-    DataTypeId.EULER_ANGLE: lambda p: cast(p.contents.value, POINTER(EulerAngles)).contents,
-    DataTypeId.QUATERNION: lambda p: cast(p.contents.value, POINTER(Quaternion)).contents,
-    DataTypeId.CORRECTED_CARTESIAN_FLOAT: lambda p: cast(p.contents.value, POINTER(CorrectedCartesianFloat)).contents,
-    DataTypeId.OVERFLOW_STATE: lambda p: cast(p.contents.value, POINTER(OverflowState)).contents,
-    DataTypeId.LOGGING_TIME: lambda p: cast(p.contents.value, POINTER(LoggingTime)).contents,
-    DataTypeId.BTLE_ADDRESS: lambda p: cast(p.contents.value, POINTER(BtleAddress)).contents,
-    DataTypeId.BOSCH_ANY_MOTION: lambda p: cast(p.contents.value, POINTER(BoschAnyMotion)).contents,
-    DataTypeId.CALIBRATION_STATE: lambda p: cast(p.contents.value, POINTER(CalibrationState)).contents,
-    DataTypeId.BOSCH_TAP: lambda p: cast(p.contents.value, POINTER(BoschTap)).contents
+_value_types = {
+    DataTypeId.UINT32: c_uint,
+    DataTypeId.INT32: c_int,
+    DataTypeId.SENSOR_ORIENTATION: c_int,
+    DataTypeId.FLOAT: c_float,
+    DataTypeId.CARTESIAN_FLOAT: CartesianFloat,
+    DataTypeId.BATTERY_STATE: BatteryState,
+    DataTypeId.TCS34725_ADC: Tcs34725ColorAdc,
+    DataTypeId.EULER_ANGLE: EulerAngles,
+    DataTypeId.QUATERNION: Quaternion,
+    DataTypeId.CORRECTED_CARTESIAN_FLOAT: CorrectedCartesianFloat,
+    DataTypeId.OVERFLOW_STATE: OverflowState,
+    DataTypeId.LOGGING_TIME: LoggingTime,
+    DataTypeId.BTLE_ADDRESS: BtleAddress,
+    DataTypeId.BOSCH_ANY_MOTION: BoschAnyMotion,
+    DataTypeId.CALIBRATION_STATE: CalibrationState,
+    DataTypeId.BOSCH_TAP: BoschTap
 }
+
+def _value_columns(value_type):
+    """Returns the (name, typecode, offset) of each field of a value type, None if the fields are not all native types"""
+    fields = value_type._fields_ if hasattr(value_type, '_fields_') else [('value', value_type)]
+
+    columns = []
+    for name, field_type in fields:
+        code = getattr(field_type, '_type_', None)
+        if not isinstance(code, str) or code not in typecodes:
+            return None
+        columns.append((name, code, getattr(value_type, name).offset if hasattr(value_type, '_fields_') else 0))
+    return columns
+
+def _value_decoder(value_type):
+    if hasattr(value_type, '_fields_'):
+        return lambda address, length: value_type.from_address(address)
+    return lambda address, length: value_type.from_address(address).value
+
+def _tuple_decoder(value_type):
+    if not hasattr(value_type, '_fields_'):
+        return _value_decoder(value_type)
+
+    columns = _value_columns(value_type)
+    if columns is None:
+        # fields that are ctypes arrays are returned as lists
+        names = [f[0] for f in value_type._fields_]
+        def decode(address, length):
+            value = value_type.from_buffer_copy(string_at(address, sizeof(value_type)))
+            return tuple(list(v) if isinstance(v, Array) else v for v in (getattr(value, n) for n in names))
+        return decode
+
+    unpacker = struct.Struct('@' + ''.join(c[1] for c in columns))
+    return lambda address, length: unpacker.unpack(string_at(address, unpacker.size))
+
+_byte_array_decoder = lambda address, length: list(string_at(address, length))
+
+_value_decoders = dict((k, _value_decoder(v)) for k, v in _value_types.items())
+_value_decoders[DataTypeId.BYTE_ARRAY] = _byte_array_decoder
+
+_tuple_decoders = dict((k, _tuple_decoder(v)) for k, v in _value_types.items())
+_tuple_decoders[DataTypeId.BYTE_ARRAY] = _byte_array_decoder
+
 def parse_value(pointer, **kwargs):
     """
     Helper function to extract the value from a Data object.  If you are storing the values to be used at a later time, 
-    call copy.deepcopy preserve the value.  You do not need to do this if the underlying type is a native type or a byte array
+    call copy.deepcopy preserve the value, or set as_tuple to receive a copy.  You do not need to do this if the underlying 
+    type is a native type or a byte array
     @params:
         pointer     - Required  : Pointer to a Data object
-        n_elem      - Optional  : Nummber of elements in the value array if the type_id attribute is DataTypeId.DATA_ARRAY
+        n_elem      - Optional  : Number of elements in the value array if the type_id attribute is DataTypeId.DATA_ARRAY
+        as_tuple    - Optional  : Return structs as a plain tuple of their field values instead of a ctypes struct 
+                                  backed by the Data object's memory, defaults to false
     """
-    if (pointer.contents.type_id in _value_parsers):
-        return _value_parsers[pointer.contents.type_id](pointer)
-    elif (pointer.contents.type_id == DataTypeId.SENSOR_ORIENTATION):
-        return _value_parsers[DataTypeId.INT32](pointer)
-    elif (pointer.contents.type_id == DataTypeId.BYTE_ARRAY):
-        array_ptr= cast(pointer.contents.value, POINTER(c_ubyte * pointer.contents.length))
-        return [array_ptr.contents[i] for i in range(0, pointer.contents.length)]
-    elif (pointer.contents.type_id == DataTypeId.DATA_ARRAY):
+    data = pointer.contents
+    decoders = _tuple_decoders if ('as_tuple' in kwargs and kwargs['as_tuple']) else _value_decoders
+    if (data.type_id in decoders):
+        return decoders[data.type_id](data.value, data.length)
+    elif (data.type_id == DataTypeId.DATA_ARRAY):
         if 'n_elem' in kwargs:
-            values = cast(pointer.contents.value, POINTER(POINTER(Data) * kwargs['n_elem']))
-            return [parse_value(values.contents[i]) for i in range(0, kwargs['n_elem'])]
+            values = (POINTER(Data) * kwargs['n_elem']).from_address(data.value)
+            return [parse_value(v, **kwargs) for v in values]
         else:
             raise RuntimeError("Missing optional parameter 'n_elem' for parsing DataTypeId.DATA_ARRAY value")
     else:
-        raise RuntimeError('Unrecognized data type id: ' + str(pointer.contents.type_id))
+        raise RuntimeError('Unrecognized data type id: ' + str(data.type_id))
 
+from .delivery import QueuedDataHandler
+from .merge import MergedStream
+from .sink import SampleSink
+from .logdownload import BinaryLogWriter, CsvLogWriter
 from threading import Event
 
 def create_voidp(fn, **kwargs):
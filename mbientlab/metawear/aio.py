@@ -0,0 +1,171 @@
+from . import libmetawear
+from .cbindings import *
+from .delivery import _sample_reader
+from .metawear import MetaWear
+
+import asyncio
+import sys
+
+if sys.version_info < (3, 7):
+    raise ImportError("mbientlab.metawear.aio requires Python 3.7 or newer for asyncio.get_running_loop")
+
+def _complete(future, error, value = None):
+    if not future.done():
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+async def create_voidp(fn, **kwargs):
+    """
+    Awaitable variant of mbientlab.metawear.create_voidp, resolves to the created object
+    @params:
+        fn          - Required  : `(FnVoid_VoidP_VoidP) -> void` function that wraps the call to a libmetawear FnVoid_VoidP_VoidP async function
+        resource    - Optional  : Name of the resource the fn is attempting to create
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def handler(ctx, pointer):
+        error = RuntimeError("Could not create " + (kwargs['resource'] if 'resource' in kwargs else "resource")) if pointer == None else None
+        loop.call_soon_threadsafe(_complete, future, error, pointer)
+
+    callback_wrapper = FnVoid_VoidP_VoidP(handler)
+    fn(callback_wrapper)
+    return await future
+
+async def create_voidp_int(fn, **kwargs):
+    """
+    Awaitable variant of mbientlab.metawear.create_voidp_int, resolves to the status
+    @params:
+        fn          - Required  : `(FnVoid_VoidP_VoidP_Int) -> void` function that wraps the call to a libmetawear FnVoid_VoidP_VoidP_Int async function
+        is_error    - Optional  : `(int) -> bool` function used to check if the async function failed, checks if the int value is equal to Const.STATUS_OK if not specified
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    is_error = kwargs['is_error'] if 'is_error' in kwargs else lambda v: v != Const.STATUS_OK
+
+    def handler(ctx, pointer, status):
+        error = RuntimeError("Non-zero status returned (%d)" % (status)) if is_error(status) else None
+        loop.call_soon_threadsafe(_complete, future, error, status)
+
+    callback_wrapper = FnVoid_VoidP_VoidP_Int(handler)
+    fn(callback_wrapper)
+    return await future
+
+class DataStream(object):
+    """
+    Async iterator over the samples of a data signal.  Samples are copied on the callback thread as (epoch, value) tuples, 
+    with values parsed by parse_value(as_tuple = True), and handed to the event loop with call_soon_threadsafe.  When the 
+    bounded queue is full, the oldest sample is dropped
+    """
+
+    _CLOSED = object()
+
+    def __init__(self, signal, **kwargs):
+        """
+        Creates a DataStream object and subscribes to the signal.  Must be called from a coroutine, samples are handed to the 
+        running event loop
+        @params:
+            signal      - Required  : Data signal to subscribe to
+            maxsize     - Optional  : Max number of samples buffered before the oldest ones are dropped, defaults to 1024
+            n_elem      - Optional  : Same as QueuedDataHandler's n_elem
+        """
+        self.signal = signal
+        self.dropped = 0
+
+        self._read_sample = _sample_reader(kwargs)
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError("DataStream must be created from a coroutine running on the event loop")
+        self.maxsize = kwargs['maxsize'] if 'maxsize' in kwargs else 1024
+        # bound is enforced by _put so the close marker never displaces a sample
+        self._queue = asyncio.Queue()
+        self._closed = False
+
+        self._callback = FnVoid_VoidP_DataP(self._data_handler)
+        libmetawear.mbl_mw_datasignal_subscribe(signal, None, self._callback)
+
+    def _data_handler(self, ctx, pointer):
+        self._loop.call_soon_threadsafe(self._put, self._read_sample(pointer))
+
+    def _put(self, sample):
+        if sample is not DataStream._CLOSED:
+            # samples still scheduled when close() ran would otherwise land behind the close marker and never be read
+            if self._closed:
+                return
+            if self._queue.qsize() >= self.maxsize:
+                self._queue.get_nowait()
+                self.dropped += 1
+        self._queue.put_nowait(sample)
+
+    def close(self):
+        """
+        Unsubscribes from the signal, iteration stops once the buffered samples are consumed
+        """
+        if not self._closed:
+            self._closed = True
+            libmetawear.mbl_mw_datasignal_unsubscribe(self.signal)
+            self._loop.call_soon_threadsafe(self._put, DataStream._CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        sample = await self._queue.get()
+        if sample is DataStream._CLOSED:
+            raise StopAsyncIteration
+        return sample
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+class AsyncMetaWear(object):
+    """asyncio wrapper around a MetaWear object"""
+
+    def __init__(self, address, **kwargs):
+        """
+        Creates an AsyncMetaWear object, all keyword arguments are forwarded to MetaWear
+        """
+        self.device = MetaWear(address, **kwargs)
+
+    @property
+    def board(self):
+        return self.device.board
+
+    @property
+    def address(self):
+        return self.device.address
+
+    @property
+    def is_connected(self):
+        return self.device.is_connected
+
+    async def connect(self, **kwargs):
+        """
+        Connects to the MetaWear board and initializes the SDK.  The connection is started on the loop's default executor 
+        since the USB transport scans the serial ports and opens the link on the calling thread
+        @params:
+            serialize   - Optional  : Serialize and cached C++ SDK state after initializaion, defaults to true
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await loop.run_in_executor(None, lambda: self.device.connect_async(lambda error: loop.call_soon_threadsafe(_complete, future, error), **kwargs))
+        await future
+
+    def disconnect(self):
+        """
+        Disconnects from the MetaWear board
+        """
+        self.device.disconnect()
+
+    def stream(self, signal, **kwargs):
+        """
+        Subscribes to the signal and returns a DataStream over its samples, keyword arguments are forwarded to DataStream.  
+        Must be called from a coroutine
+        """
+        return DataStream(signal, **kwargs)
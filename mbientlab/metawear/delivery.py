@@ -0,0 +1,139 @@
+from . import parse_value
+from .cbindings import *
+from collections import deque
+from threading import Condition
+
+import threading
+
+def _sample_reader(kwargs):
+    """
+    Returns a `(Data*) -> (int, object)` function that copies a sample's epoch and value, parsed by 
+    parse_value(as_tuple = True), forwarding the n_elem keyword argument if given
+    """
+    parse_args = { 'as_tuple': True }
+    if 'n_elem' in kwargs:
+        parse_args['n_elem'] = kwargs['n_elem']
+
+    def read(pointer):
+        return (pointer.contents.epoch, parse_value(pointer, **parse_args))
+    return read
+
+class _DeliveryThread(object):
+    """
+    Base class for handlers that buffer samples on libmetawear callback threads and deliver them from a worker thread.  
+    Subclasses guard their buffers with _cond and start the worker with their delivery loop, which calls _deliver with each 
+    batch and returns once _closed is set and nothing is left to deliver
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.delivered = 0
+
+        self._cond = Condition()
+        self._closed = False
+
+    def _start_worker(self, run):
+        self._worker = threading.Thread(target=run, daemon=True)
+        self._worker.start()
+
+    def _deliver(self, batch):
+        for args in batch:
+            try:
+                self.handler(*args)
+            except Exception as err:
+                print(str(err))
+            self.delivered += 1
+
+    def _close(self, timeout):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+
+class QueuedDataHandler(_DeliveryThread):
+    """
+    Data handler that moves work off the libmetawear callback thread.  Each sample is copied as an (epoch, value) tuple, 
+    with the value parsed by parse_value(as_tuple = True), into a bounded buffer that a worker thread drains into the 
+    user's handler, so a slow handler no longer stalls notification delivery
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+
+    def __init__(self, handler, **kwargs):
+        """
+        Creates a QueuedDataHandler object and starts its worker thread
+        @params:
+            handler     - Required  : `(int, object) -> void` function called on the worker thread with each sample's epoch and value
+            capacity    - Optional  : Max number of samples buffered, defaults to 1024
+            overflow    - Optional  : What to do when the buffer is full: BLOCK the callback thread until there is space, 
+                                      DROP_OLDEST buffered sample, or DROP_NEWEST i.e. the incoming sample.  Defaults to BLOCK
+            n_elem      - Optional  : Number of elements in the value array if the signal produces DataTypeId.DATA_ARRAY values
+        """
+        _DeliveryThread.__init__(self, handler)
+        self.capacity = kwargs['capacity'] if ('capacity' in kwargs) else 1024
+        self.overflow = kwargs['overflow'] if ('overflow' in kwargs) else QueuedDataHandler.BLOCK
+        if self.overflow not in (QueuedDataHandler.BLOCK, QueuedDataHandler.DROP_OLDEST, QueuedDataHandler.DROP_NEWEST):
+            raise ValueError("Unrecognized overflow policy '%s'" % (self.overflow))
+
+        self.received = 0
+        self.dropped = 0
+        self.high_water_mark = 0
+
+        self._read_sample = _sample_reader(kwargs)
+        self._buffer = deque()
+        self._start_worker(self._run)
+
+        self.callback = FnVoid_VoidP_DataP(self._data_handler)
+
+    def _data_handler(self, ctx, pointer):
+        sample = self._read_sample(pointer)
+        with self._cond:
+            self.received += 1
+            if len(self._buffer) >= self.capacity:
+                if self.overflow == QueuedDataHandler.BLOCK:
+                    while len(self._buffer) >= self.capacity and not self._closed:
+                        self._cond.wait()
+                elif self.overflow == QueuedDataHandler.DROP_OLDEST:
+                    self._buffer.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return
+            if self._closed:
+                self.dropped += 1
+                return
+
+            self._buffer.append(sample)
+            if len(self._buffer) > self.high_water_mark:
+                self.high_water_mark = len(self._buffer)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while len(self._buffer) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._buffer) == 0:
+                    return
+                batch = self._buffer
+                self._buffer = deque()
+                self._cond.notify_all()
+
+            self._deliver(batch)
+
+    @property
+    def pending(self):
+        """
+        Number of samples waiting to be delivered
+        """
+        return len(self._buffer)
+
+    def close(self, **kwargs):
+        """
+        Stops accepting samples and waits for the worker to deliver the buffered ones
+        @params:
+            timeout     - Optional  : Max seconds to wait for the worker to finish, waits indefinitely if not set
+        """
+        self._close(kwargs['timeout'] if 'timeout' in kwargs else None)
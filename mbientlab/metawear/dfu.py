@@ -0,0 +1,339 @@
+from . import libmetawear
+from .cbindings import *
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from types import SimpleNamespace
+
+import os
+import threading
+import time
+import zipfile
+
+def _image_size(path):
+    """Returns the number of bytes the DFU transfer sends, i.e. the size of the firmware binary inside a DFU zip"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as z:
+            entries = [i for i in z.infolist() if not i.filename.endswith('.json') and not i.filename.endswith('.dat')]
+            binaries = [i for i in entries if i.filename.endswith('.bin')]
+            return sum(i.file_size for i in (binaries if len(binaries) else entries))
+    return os.path.getsize(path)
+
+class FirmwareUpdate(object):
+    """
+    Updates the firmware on a board from a dedicated thread.  The board is put in MetaBoot mode, and the transfer is
+    retried from MetaBoot mode if the connection drops or the transfer stalls.  libmetawear always restarts a transfer
+    from the first byte, so a retry only skips jumping to the bootloader and downloading the image again
+    """
+
+    def __init__(self, device, **kwargs):
+        self.device = device
+        self.version = kwargs['version'] if 'version' in kwargs else None
+        self.progress_handler = kwargs['progress_handler'] if 'progress_handler' in kwargs else None
+        self.throughput_handler = kwargs['throughput_handler'] if 'throughput_handler' in kwargs else None
+        self.retries = kwargs['retries'] if 'retries' in kwargs else 2
+        self.timeout = kwargs['timeout'] if 'timeout' in kwargs else 30.0
+
+        self.attempts = 0
+        self.total_bytes = 0
+        self._delegates = []
+
+    def start(self, handler):
+        def run():
+            try:
+                self.run()
+            except Exception as err:
+                handler(err)
+            else:
+                handler(None)
+        threading.Thread(target=run, daemon=True).start()
+
+    def _connect(self):
+        """Connects to the board, retrying until the timeout passes since it may still be rebooting"""
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                self.device.connect()
+                return
+            except Exception:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _jump_to_bootloader(self):
+        disconnected = Event()
+        dc_copy = self.device.on_disconnect
+        self.device.on_disconnect = lambda status: disconnected.set()
+        try:
+            libmetawear.mbl_mw_debug_jump_to_bootloader(self.device.board)
+            if not disconnected.wait(self.timeout):
+                raise RuntimeError("Board did not reset into MetaBoot mode")
+        finally:
+            self.device.on_disconnect = dc_copy
+
+        self._connect()
+        if not self.device.in_metaboot_mode:
+            raise RuntimeError("DFU service not found")
+
+    def _transfer(self, path):
+        """Runs one DFU transfer, raises if it fails, is cancelled, stalls for longer than the timeout, or the connection drops"""
+        state = SimpleNamespace(done = Event(), progress = Event(), error = None, succeeded = False, start = None)
+        disconnected = Event()
+
+        def failed(err):
+            if state.error is None:
+                state.error = err
+            state.done.set()
+            state.progress.set()
+
+        def started(ctx):
+            state.start = time.time()
+            state.progress.set()
+
+        def transferred(ctx, percentage):
+            state.progress.set()
+            if self.progress_handler is not None:
+                self.progress_handler(percentage)
+            if self.throughput_handler is not None:
+                elapsed = time.time() - (state.start if state.start is not None else time.time())
+                sent = self.total_bytes * percentage // 100
+                rate = sent / elapsed if elapsed > 0 else 0.0
+                self.throughput_handler(sent, self.total_bytes, rate, (self.total_bytes - sent) / rate if rate > 0 else None)
+
+        def succeeded(ctx):
+            state.succeeded = True
+            state.done.set()
+            state.progress.set()
+
+        def lost(status):
+            disconnected.set()
+            if not state.succeeded:
+                failed(RuntimeError("Connection lost during DFU"))
+
+        callbacks = (FnVoid_VoidP(started), FnVoid_VoidP(lambda ctx: failed(RuntimeError("DFU operation cancelled"))),
+                FnVoid_VoidP_Int(transferred), FnVoid_VoidP(succeeded),
+                FnVoid_VoidP_charP(lambda ctx, msg: failed(RuntimeError(msg.decode() if msg is not None else "DFU error"))))
+        delegate = DfuDelegate(context = None, on_dfu_started = callbacks[0], on_dfu_cancelled = callbacks[1],
+                on_transfer_percentage = callbacks[2], on_successful_file_transferred = callbacks[3], on_error = callbacks[4])
+        path_buffer = create_string_buffer(path.encode('ascii'))
+        # keep every attempt's delegate alive, libmetawear may still call one after the attempt was given up on
+        self._delegates.append((callbacks, delegate, path_buffer))
+
+        dc_copy = self.device.on_disconnect
+        self.device.on_disconnect = lost
+        try:
+            libmetawear.mbl_mw_metawearboard_perform_dfu(self.device.board, byref(delegate), path_buffer.raw)
+
+            while not state.done.is_set():
+                state.progress.clear()
+                if not state.progress.wait(self.timeout) and not state.done.is_set():
+                    failed(RuntimeError("DFU transfer stalled"))
+
+            if state.succeeded:
+                # the board resets into the new firmware once the image is validated, wait for that instead of sleeping
+                disconnected.wait(self.timeout)
+                return
+        finally:
+            self.device.on_disconnect = dc_copy
+
+        if state.error is not None:
+            raise state.error
+
+    def run(self):
+        """Synchronously updates the firmware"""
+        # download before leaving the application firmware so a missing image does not strand the board in MetaBoot mode
+        path = self.device._download_firmware(version = self.version)
+        self.total_bytes = _image_size(path)
+
+        if not self.device.in_metaboot_mode:
+            self._jump_to_bootloader()
+
+        while True:
+            self.attempts += 1
+            try:
+                self._transfer(path)
+                return
+            except RuntimeError:
+                if self.attempts > self.retries:
+                    raise
+            # the board stays in MetaBoot mode after a failed transfer, resume from there
+            if self.device.is_connected:
+                self.device.disconnect()
+            self._connect()
+            if not self.device.in_metaboot_mode:
+                # the bootloader timed out and the board restarted the application firmware
+                self._jump_to_bootloader()
+
+def update_firmware_all(devices, **kwargs):
+    """
+    Updates the firmware of several boards concurrently.  Returns one result per board, in the order given, with the
+    device, error (None on success), number of transfer attempts, and elapsed seconds
+    @params:
+        devices         - Required  : List of connected MetaWear objects
+        max_parallel    - Optional  : Max number of boards being updated at the same time, defaults to 4
+    Other optional parameters are the same as MetaWear.update_firmware_async's
+    """
+    max_parallel = kwargs.pop('max_parallel') if 'max_parallel' in kwargs else 4
+
+    def update(device):
+        result = SimpleNamespace(device = device, error = None, attempts = 0, elapsed = 0.0)
+        start = time.time()
+        task = FirmwareUpdate(device, **kwargs)
+        try:
+            task.run()
+        except Exception as err:
+            result.error = err
+        result.attempts = task.attempts
+        result.elapsed = time.time() - start
+        return result
+
+    with ThreadPoolExecutor(max_workers = max_parallel) as executor:
+        return list(executor.map(update, devices))
+
+class FirmwareRollout(object):
+    """
+    Updates the firmware of a fleet of boards.  Every board is briefly connected to, to read its firmware version, each 
+    (hardware, model) image is downloaded once into a shared FirmwareCache, then the outdated boards are reconnected and 
+    updated in waves.  A wave whose failure rate exceeds the abort threshold stops the rollout
+    """
+
+    def __init__(self, addresses, **kwargs):
+        """
+        Creates a FirmwareRollout object
+        @params:
+            addresses       - Required  : List of mac addresses of the boards to update
+            version         - Optional  : Firmware version to install, defaults to the latest one for each board
+            firmware_cache  - Optional  : FirmwareCache object the images are stored in, defaults to one in the 'firmware' directory
+                                          of device_args' cache_path
+            wave_size       - Optional  : Number of boards per wave, defaults to 8
+            max_parallel    - Optional  : Max number of boards connected to or updated at the same time, defaults to 4
+            retries         - Optional  : Number of times a failed connection or transfer is retried per board, defaults to 2
+            abort_threshold - Optional  : Fraction of failed boards in a wave that stops the rollout, defaults to 0.5
+            verify          - Optional  : Reconnect after the update to check the installed version, defaults to true
+            device_args     - Optional  : Dict of keyword arguments passed to each MetaWear object
+        Other optional parameters, e.g. timeout and throughput_handler, are passed on to each FirmwareUpdate
+        """
+        from .firmware import FirmwareCache
+
+        self.addresses = [a.upper() for a in addresses]
+        self.version = kwargs.pop('version') if 'version' in kwargs else None
+        self.wave_size = kwargs.pop('wave_size') if 'wave_size' in kwargs else 8
+        self.max_parallel = kwargs.pop('max_parallel') if 'max_parallel' in kwargs else 4
+        self.retries = kwargs.pop('retries') if 'retries' in kwargs else 2
+        self.abort_threshold = kwargs.pop('abort_threshold') if 'abort_threshold' in kwargs else 0.5
+        self.verify = kwargs.pop('verify') if 'verify' in kwargs else True
+        self.device_args = dict(kwargs.pop('device_args')) if 'device_args' in kwargs else {}
+        if 'firmware_cache' in kwargs:
+            self.firmware_cache = kwargs.pop('firmware_cache')
+        else:
+            cache_path = self.device_args['cache_path'] if 'cache_path' in self.device_args else ".metawear"
+            self.firmware_cache = FirmwareCache(os.path.join(cache_path, "firmware"))
+        self.device_args['firmware_cache'] = self.firmware_cache
+        self.update_args = kwargs
+
+        self.results = []
+        self._installed = {}
+
+    def _is_current(self, installed, target):
+        from .firmware import _version_key
+        if self.version is not None:
+            return installed == target
+        try:
+            return _version_key(installed) >= _version_key(target)
+        except (AttributeError, TypeError, ValueError):
+            # a revision that cannot be compared is updated rather than stopping the rollout for every board
+            return False
+
+    def _plan(self, results):
+        """Resolves each board's target version and downloads each (hardware, model) image once"""
+        images = {}
+        for r in results:
+            if r.status is not None:
+                continue
+            key = (r.device.info['hardware'], r.device.info['model'])
+            if key not in images:
+                try:
+                    entry = self.firmware_cache.resolve(key[0], key[1], version = self.version)
+                    self.firmware_cache.fetch(key[0], key[1], version = entry.version)
+                    images[key] = (entry.version, None)
+                except Exception as err:
+                    images[key] = (None, err)
+
+            r.target, r.error = images[key]
+            if r.error is not None:
+                r.status = 'failed'
+            elif r.installed is not None and self._is_current(r.installed, r.target):
+                r.status = 'up_to_date'
+
+    def _survey(self, device):
+        """Records the installed firmware and disconnects right away, an adapter only holds a few links at once"""
+        self._installed[device.address] = device.info['firmware'] if 'firmware' in device.info else None
+        device.disconnect()
+
+    def _update(self, r):
+        """Connects to the board, updates it if it is still outdated, and disconnects"""
+        task = FirmwareUpdate(r.device, version = r.target, retries = self.retries, **self.update_args)
+        try:
+            task._connect()
+            r.firmware = r.device.info['firmware'] if 'firmware' in r.device.info else None
+            if r.firmware is not None and self._is_current(r.firmware, r.target):
+                r.status = 'up_to_date'
+                return r
+
+            task.run()
+            if self.verify:
+                task._connect()
+                r.firmware = r.device.info['firmware']
+                if r.firmware != r.target:
+                    raise RuntimeError("Board reports firmware '%s' after updating to '%s'" % (r.firmware, r.target))
+            r.status = 'updated'
+        except Exception as err:
+            r.error = err
+            r.status = 'failed'
+        finally:
+            if r.device.is_connected:
+                r.device.disconnect()
+        r.attempts = task.attempts
+        return r
+
+    def run(self, **kwargs):
+        """
+        Runs the rollout and returns one result per address, in the order given.  Each result has the address, device, 
+        firmware version installed before the rollout, version reported at the end, target version, number of transfer 
+        attempts, error, and status: 'up_to_date', 'updated', 'failed', 'unreachable', or 'skipped' if the rollout was aborted.  
+        At most max_parallel boards are connected at a time
+        @params:
+            wave_handler    - Optional  : `(int, list) -> void` function called with the wave index and its results as each wave finishes
+        """
+        from .session import MetaWearSession
+
+        wave_handler = kwargs['wave_handler'] if 'wave_handler' in kwargs else None
+        session = MetaWearSession(self.addresses, max_parallel = self.max_parallel, retries = self.retries, device_args = self.device_args)
+
+        self._installed = {}
+        self.results = []
+        for s in session.connect(configure = self._survey):
+            r = SimpleNamespace(address = s.address, device = s.device, installed = None, firmware = None, target = None, 
+                    attempts = 0, error = s.error, status = None)
+            if s.error is not None:
+                r.status = 'unreachable'
+                if s.device is not None and s.device.is_connected:
+                    s.device.disconnect()
+            else:
+                r.installed = self._installed[s.device.address]
+                r.firmware = r.installed
+            self.results.append(r)
+
+        self._plan(self.results)
+
+        pending = [r for r in self.results if r.status is None]
+        with ThreadPoolExecutor(max_workers = self.max_parallel) as executor:
+            for i in range(0, len(pending), self.wave_size):
+                wave = list(executor.map(self._update, pending[i:i + self.wave_size]))
+                if wave_handler is not None:
+                    wave_handler(i // self.wave_size, wave)
+                if sum(1 for r in wave if r.status == 'failed') > self.abort_threshold * len(wave):
+                    for r in pending[i + self.wave_size:]:
+                        r.status = 'skipped'
+                    break
+
+        return self.results
@@ -0,0 +1,269 @@
+from types import SimpleNamespace
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
+
+def _write_atomic(path, content):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+def _version_key(version):
+    """
+    Sort key for a dotted firmware version.  Each segment is compared by its leading digits, a segment with a suffix, e.g. 
+    the '3b' of '1.7.3b' or '3-beta' of '1.7.3-beta', sorts below the plain release and segments without digits sort first
+    """
+    key = []
+    for segment in version.split('.'):
+        digits = len(segment) - len(segment.lstrip('0123456789'))
+        suffix = segment[digits:]
+        key.append((int(segment[:digits]) if digits else -1, 0 if suffix else 1, suffix))
+    return tuple(key)
+
+class FirmwareCache(object):
+    """
+    Content addressed cache of MetaWear firmware images shared by any number of boards.  Images are stored once under
+    their sha256 hash, with a small index mapping (hardware, model, branch, version) to the hash.  The release index,
+    info1.json, is revalidated with ETag / If-Modified-Since requests instead of being downloaded again
+    """
+
+    RELEASES_URL = "https://releases.mbientlab.com/metawear"
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, root, **kwargs):
+        """
+        Creates a FirmwareCache object
+        @params:
+            root        - Required  : Directory the cache is stored in, can be shared by several processes
+            mirror      - Optional  : Local directory with the same layout as the release server, i.e. info1.json and
+                                      <hardware>/<model>/<branch>/<version>/<filename>, to use instead of the network
+            max_age     - Optional  : Seconds the cached release index is used before it is revalidated, defaults to 1800
+            timeout     - Optional  : Seconds to wait on the release server, defaults to 30
+        """
+        self.root = root
+        self.mirror = kwargs['mirror'] if ('mirror' in kwargs) else None
+        self.max_age = kwargs['max_age'] if ('max_age' in kwargs) else 1800.0
+        self.timeout = kwargs['timeout'] if ('timeout' in kwargs) else 30.0
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._index = None
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _read_json(self, path, default):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return default
+
+    def _fetch_index(self):
+        import requests
+
+        path = self._path("info1.json")
+        meta_path = self._path("info1.meta.json")
+        meta = self._read_json(meta_path, {})
+
+        headers = {}
+        if os.path.isfile(path):
+            if 'etag' in meta:
+                headers['If-None-Match'] = meta['etag']
+            if 'last_modified' in meta:
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            r = requests.get("%s/info1.json" % (FirmwareCache.RELEASES_URL), headers = headers, timeout = self.timeout)
+            if r.status_code == 304:
+                os.utime(path, None)
+                return self._read_json(path, None)
+            r.raise_for_status()
+            content = r.json()
+        except (requests.RequestException, ValueError):
+            # offline, fall back on the stale index if there is one
+            cached = self._read_json(path, None)
+            if cached is None:
+                raise
+            return cached
+
+        _makedirs(self.root)
+        _write_atomic(path, json.dumps(content).encode('utf8'))
+        meta = {}
+        if 'ETag' in r.headers:
+            meta['etag'] = r.headers['ETag']
+        if 'Last-Modified' in r.headers:
+            meta['last_modified'] = r.headers['Last-Modified']
+        _write_atomic(meta_path, json.dumps(meta).encode('utf8'))
+        return content
+
+    def index(self, **kwargs):
+        """
+        Returns the release index, revalidating the cached copy once it is older than max_age
+        @params:
+            refresh     - Optional  : Revalidate the cached index regardless of its age, defaults to false
+        """
+        with self._lock:
+            if self.mirror is not None:
+                if self._index is None:
+                    with open(os.path.join(self.mirror, "info1.json"), "r") as f:
+                        self._index = json.load(f)
+                return self._index
+
+            path = self._path("info1.json")
+            refresh = 'refresh' in kwargs and kwargs['refresh']
+            if refresh or not os.path.isfile(path) or (time.time() - os.path.getmtime(path)) > self.max_age:
+                self._index = self._fetch_index()
+            elif self._index is None:
+                self._index = self._read_json(path, None)
+                if self._index is None:
+                    self._index = self._fetch_index()
+            return self._index
+
+    def resolve(self, hardware, model, **kwargs):
+        """
+        Returns the release index entry of a firmware image, with its version and filename
+        @params:
+            hardware    - Required  : Hardware revision, i.e. MetaWear.info['hardware']
+            model       - Required  : Model number, i.e. MetaWear.info['model']
+            version     - Optional  : Firmware version, defaults to the latest one available
+            branch      - Optional  : Release branch, defaults to 'vanilla'
+        """
+        branch = kwargs['branch'] if ('branch' in kwargs) else "vanilla"
+        try:
+            releases = self.index()[hardware][model][branch]
+        except KeyError:
+            raise ValueError("No firmware available for hardware '%s', model '%s'" % (hardware, model))
+
+        if 'version' not in kwargs or kwargs['version'] is None:
+            version = max(releases.keys(), key = _version_key)
+        else:
+            version = kwargs['version']
+            if version not in releases:
+                raise ValueError("Firmware '%s' not available for this board" % (version))
+
+        entry = SimpleNamespace(**releases[version])
+        entry.hardware = hardware
+        entry.model = model
+        entry.branch = branch
+        entry.version = version
+        return entry
+
+    def _object_path(self, digest, filename):
+        # keep the extension, libmetawear picks the DFU procedure from it
+        return self._path("objects", digest[:2], digest + os.path.splitext(filename)[1])
+
+    def _verify(self, path, digest):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(FirmwareCache.CHUNK_SIZE), b''):
+                h.update(chunk)
+        return h.hexdigest() == digest
+
+    def _store(self, chunks, entry, size):
+        """
+        Streams the chunks into a temporary file while hashing them, checks the image is complete, then renames it to its 
+        content address.  The release index has no hashes, so the byte count and, for zip images, the archive's CRCs are 
+        what catch a truncated or corrupted download
+        """
+        tmp_dir = self._path("tmp")
+        _makedirs(tmp_dir)
+        tmp = os.path.join(tmp_dir, "%s.%d.%d" % (entry.filename, os.getpid(), threading.current_thread().ident))
+
+        h = hashlib.sha256()
+        received = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+                    received += len(chunk)
+            if size is not None and received != size:
+                raise ValueError("Firmware '%s' is incomplete, received %d of %d bytes" % (entry.filename, received, size))
+            if entry.filename.lower().endswith(".zip"):
+                try:
+                    with zipfile.ZipFile(tmp) as z:
+                        corrupted = z.testzip()
+                except zipfile.BadZipfile:
+                    raise ValueError("Firmware '%s' is not a valid zip archive" % (entry.filename))
+                if corrupted is not None:
+                    raise ValueError("Firmware '%s' is corrupted ('%s' failed its CRC check)" % (entry.filename, corrupted))
+
+            digest = h.hexdigest()
+            if hasattr(entry, 'sha256') and entry.sha256.lower() != digest:
+                raise ValueError("Firmware '%s' failed its integrity check" % (entry.filename))
+
+            path = self._object_path(digest, entry.filename)
+            _makedirs(os.path.dirname(path))
+            os.replace(tmp, path)
+        finally:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+        return digest, path
+
+    def _download(self, entry):
+        parts = (entry.hardware, entry.model, entry.branch, entry.version, entry.filename)
+        if self.mirror is not None:
+            path = os.path.join(self.mirror, *parts)
+            with open(path, "rb") as f:
+                return self._store(iter(lambda: f.read(FirmwareCache.CHUNK_SIZE), b''), entry, os.path.getsize(path))
+
+        import requests
+        r = requests.get("/".join((FirmwareCache.RELEASES_URL,) + parts), stream = True, timeout = self.timeout)
+        try:
+            r.raise_for_status()
+            # iter_content decodes compressed responses, Content-Length is then the compressed size
+            size = int(r.headers['Content-Length']) if 'Content-Length' in r.headers and 'Content-Encoding' not in r.headers else None
+            return self._store(r.iter_content(chunk_size = FirmwareCache.CHUNK_SIZE), entry, size)
+        finally:
+            r.close()
+
+    def fetch(self, hardware, model, **kwargs):
+        """
+        Returns the local path of a firmware image, downloading it if it is not cached or the cached copy does not
+        match its recorded hash.  Takes the same optional parameters as `resolve`
+        """
+        entry = self.resolve(hardware, model, **kwargs)
+        key = "/".join((entry.hardware, entry.model, entry.branch, entry.version, entry.filename))
+
+        refs_path = self._path("refs.json")
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # only fetches of the same image wait on each other, the shared lock just guards refs.json
+        with key_lock:
+            with self._lock:
+                refs = self._read_json(refs_path, {})
+            if key in refs:
+                path = self._object_path(refs[key], entry.filename)
+                if os.path.isfile(path) and self._verify(path, refs[key]):
+                    return path
+
+            digest, path = self._download(entry)
+
+            with self._lock:
+                refs = self._read_json(refs_path, {})
+                refs[key] = digest
+                _write_atomic(refs_path, json.dumps(refs, indent = 2, sort_keys = True).encode('utf8'))
+            return path
+
+    def purge(self):
+        """Removes every cached image and the release index"""
+        with self._lock:
+            self._index = None
+            if os.path.isdir(self.root):
+                shutil.rmtree(self.root)
@@ -0,0 +1,243 @@
+from . import libmetawear, parse_value
+from .cbindings import *
+from .sink import SampleSink
+from array import array
+from threading import Event
+from types import SimpleNamespace
+
+import json
+import os
+import threading
+import time
+
+# ctypes callbacks libmetawear may still call after the download gave up on them, kept alive until they fire
+_pending_callbacks = set()
+
+class CsvLogWriter(object):
+    """
+    Writes each logger's entries to '[prefix][identifier].csv' through a large write buffer.  Columns that are lists rather 
+    than arrays, i.e. values that cannot be stored in columns, are written as quoted JSON
+    """
+
+    def __init__(self, directory = ".", **kwargs):
+        """
+        Creates a CsvLogWriter object
+        @params:
+            directory   - Optional  : Directory the files are written to, defaults to the current directory
+            prefix      - Optional  : String prepended to the file names
+            buffer_size - Optional  : Size of each file's write buffer in bytes, defaults to 1MiB
+        """
+        self.directory = directory
+        self.prefix = kwargs['prefix'] if 'prefix' in kwargs else ''
+        self.buffer_size = kwargs['buffer_size'] if 'buffer_size' in kwargs else 1 << 20
+        self.paths = []
+        self._files = {}
+
+    def write(self, identifier, fields, chunk):
+        if identifier not in self._files:
+            path = os.path.join(self.directory, '%s%s.csv' % (self.prefix, identifier))
+            f = open(path, "w", buffering = self.buffer_size)
+            f.write(','.join(fields) + '\n')
+            self._files[identifier] = (f, '%d' + ',%s' * (len(fields) - 1) + '\n')
+            self.paths.append(path)
+
+        f, row = self._files[identifier]
+        columns = [chunk[name] if isinstance(chunk[name], array) else 
+                ['"%s"' % (json.dumps(v).replace('"', '""')) for v in chunk[name]] for name in fields]
+        f.write(''.join([row % r for r in zip(*columns)]))
+
+    def close(self):
+        for f, row in self._files.values():
+            f.close()
+        self._files = {}
+
+class BinaryLogWriter(object):
+    """
+    Writes each logger's entries in a columnar layout: a '[prefix][identifier]' directory holding one file of raw native 
+    values per column, '[column].bin', and a 'columns.json' file with the column names, array typecodes, and row count.  
+    Columns that are lists rather than arrays are written one JSON value per line to '[column].jsonl', with a null typecode
+    """
+
+    def __init__(self, directory = ".", **kwargs):
+        """
+        Creates a BinaryLogWriter object
+        @params:
+            directory   - Optional  : Directory the logger directories are created in, defaults to the current directory
+            prefix      - Optional  : String prepended to the directory names
+        """
+        self.directory = directory
+        self.prefix = kwargs['prefix'] if 'prefix' in kwargs else ''
+        self.paths = []
+        self._loggers = {}
+
+    def write(self, identifier, fields, chunk):
+        if identifier not in self._loggers:
+            path = os.path.join(self.directory, '%s%s' % (self.prefix, identifier))
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            columns = []
+            for name in fields:
+                typecode = chunk[name].typecode if isinstance(chunk[name], array) else None
+                columns.append((name, typecode, open(os.path.join(path, '%s.%s' % (name, 'bin' if typecode else 'jsonl')), "wb")))
+            self._loggers[identifier] = SimpleNamespace(path = path, columns = columns, rows = 0)
+            self.paths.append(path)
+
+        logger = self._loggers[identifier]
+        for name, typecode, f in logger.columns:
+            if typecode is None:
+                f.write(''.join([json.dumps(v) + '\n' for v in chunk[name]]).encode('utf8'))
+            else:
+                chunk[name].tofile(f)
+        logger.rows += len(chunk['epoch'])
+
+    def close(self):
+        for logger in self._loggers.values():
+            for name, typecode, f in logger.columns:
+                f.close()
+            with open(os.path.join(logger.path, 'columns.json'), "w") as f:
+                f.write(json.dumps({ 
+                    "rows": logger.rows, 
+                    "columns": [{ "name": name, "typecode": typecode } for name, typecode, f in logger.columns] 
+                }))
+        self._loggers = {}
+
+class LogDownload(object):
+    """
+    Downloads the entries of every active logger on a board.  The download is driven from a dedicated thread: entries are 
+    decoded into SampleSink columns on the callback thread, and the thread periodically drains the columns into the writer.  
+    Entries the columns cannot hold, e.g. byte arrays, are kept as parse_value(as_tuple = True) rows and written as an 
+    'epoch' and 'value' list
+    """
+
+    def __init__(self, device, **kwargs):
+        self.device = device
+        self.writer = kwargs['writer'] if 'writer' in kwargs else CsvLogWriter()
+        self.n_notifies = kwargs['n_notifies'] if 'n_notifies' in kwargs else 100
+        self.flush_interval = kwargs['flush_interval'] if 'flush_interval' in kwargs else 0.25
+        self.progress_handler = kwargs['progress_handler'] if 'progress_handler' in kwargs else None
+        self.profile = kwargs['profile'] if 'profile' in kwargs else 'download'
+
+        self.entries = 0
+        self.skipped = 0
+        self._sinks = []
+        self._signals = []
+
+    def start(self, handler):
+        threading.Thread(target=self._run, args=(handler,), daemon=True).start()
+
+    def _create_sinks(self):
+        e = Event()
+        result = {}
+
+        def created(ctx, board, signals, length):
+            result['length'] = length
+            result['signals'] = cast(signals, POINTER(c_void_p * length)) if signals is not None else None
+            _pending_callbacks.discard(created_fn)
+            e.set()
+
+        created_fn = FnVoid_VoidP_VoidP_VoidP_UInt(created)
+        _pending_callbacks.add(created_fn)
+        libmetawear.mbl_mw_metawearboard_create_anonymous_datasignals(self.device.board, None, created_fn)
+        while not e.wait(self.flush_interval):
+            if not self.device.is_connected:
+                raise RuntimeError("Disconnected during log download")
+
+        if result['signals'] is None:
+            if result['length'] != 0:
+                raise RuntimeError("Error creating anonymous signals, status = %d" % (result['length']))
+            return
+
+        for signal in result['signals'].contents:
+            identifier = libmetawear.mbl_mw_anonymous_datasignal_get_identifier(signal).decode()
+            rows = SimpleNamespace(lock = threading.Lock(), entries = [])
+            def fallback(pointer, rows = rows):
+                try:
+                    value = parse_value(pointer, as_tuple = True)
+                except RuntimeError:
+                    # DataTypeId.DATA_ARRAY values need their element count, which anonymous signals do not provide
+                    self.skipped += 1
+                    return
+                with rows.lock:
+                    rows.entries.append((pointer.contents.epoch, value))
+
+            sink = SampleSink(capacity = 8192, fallback = fallback)
+            libmetawear.mbl_mw_anonymous_datasignal_subscribe(signal, None, sink.callback)
+            self._signals.append(signal)
+            self._sinks.append((identifier, sink, rows))
+
+    def _unsubscribe(self):
+        # the sinks' callbacks are only referenced by this object, libmetawear must not call them once it is gone
+        for signal in self._signals:
+            libmetawear.mbl_mw_anonymous_datasignal_unsubscribe(signal)
+        self._signals = []
+
+    def _flush(self):
+        for identifier, sink, rows in self._sinks:
+            chunk = sink.drain()
+            if len(chunk) and len(chunk['epoch']):
+                self.writer.write(identifier, ['epoch'] + sink.fields, chunk)
+                self.entries += len(chunk['epoch'])
+
+            with rows.lock:
+                entries = rows.entries
+                rows.entries = []
+            if len(entries):
+                # entries whose type differs from the logger's columns are kept apart from them
+                self.writer.write(identifier if sink.type_id is None else identifier + '-other', ['epoch', 'value'],
+                        { 'epoch': array('q', [e[0] for e in entries]), 'value': [e[1] for e in entries] })
+                self.entries += len(entries)
+
+    def _restore_profile(self, previous):
+        # when neither a profile nor the transport's parameters are known there is nothing to go back to
+        if self.profile is not None and previous is not None and self.device.is_connected:
+            self.device.set_connection_profile(previous)
+
+    def _run(self, handler):
+        done = Event()
+
+        def progress_update(ctx, entries_left, total_entries):
+            if self.progress_handler is not None:
+                elapsed = time.time() - start
+                self.progress_handler(entries_left, total_entries, (total_entries - entries_left) / elapsed if elapsed > 0 else 0.0)
+            if (entries_left == 0):
+                done.set()
+
+        def unknown_entry(ctx, id, epoch, data, length):
+            print("unknown entry = " + str(id))
+
+        previous = self.device.connection_profile
+        if previous is None:
+            previous = getattr(self.device.conn, 'connection_parameters', None)
+        try:
+            if self.profile is not None:
+                self.device.set_connection_profile(self.profile)
+            self._create_sinks()
+
+            progress_update_fn = FnVoid_VoidP_UInt_UInt(progress_update)
+            unknown_entry_fn = FnVoid_VoidP_UByte_Long_UByteP_UByte(unknown_entry)
+            download_handler = LogDownloadHandler(context = None, received_progress_update = progress_update_fn, 
+                    received_unknown_entry = unknown_entry_fn, received_unhandled_entry = cast(None, FnVoid_VoidP_DataP))
+
+            start = time.time()
+            libmetawear.mbl_mw_logging_download(self.device.board, self.n_notifies, byref(download_handler))
+            while not done.wait(self.flush_interval):
+                if not self.device.is_connected:
+                    raise RuntimeError("Disconnected during log download")
+                self._flush()
+            self._flush()
+            elapsed = time.time() - start
+        except Exception as err:
+            self._unsubscribe()
+            self.writer.close()
+            self._restore_profile(previous)
+            handler(None, err)
+            return
+
+        self._unsubscribe()
+        self.writer.close()
+        self._restore_profile(previous)
+        self.skipped += sum(sink.skipped for identifier, sink, rows in self._sinks)
+        if self.skipped:
+            print("%d log entries could not be decoded and were not written" % (self.skipped))
+        handler(SimpleNamespace(entries = self.entries, skipped = self.skipped, elapsed = elapsed, 
+                entries_per_sec = self.entries / elapsed if elapsed > 0 else 0.0, paths = getattr(self.writer, 'paths', [])), None)
@@ -0,0 +1,193 @@
+from . import libmetawear
+from .cbindings import *
+from .delivery import _DeliveryThread, _sample_reader
+from collections import deque
+from types import SimpleNamespace
+
+import heapq
+import time
+
+class _ClockEstimate(object):
+    """
+    Estimates a board clock's offset and drift relative to the host clock.  Each sample's host arrival time minus its
+    epoch is the offset plus a variable delivery delay, so the minimum difference in each bucket of board time is kept
+    and a line is fit through the recent minima
+    """
+
+    BUCKET_MS = 1000.0
+
+    def __init__(self, window):
+        self.offset = None
+        self.drift = 0.0
+
+        self._origin = None
+        self._minima = deque(maxlen = max(2, window))
+        self._bucket_start = None
+        self._bucket_min = None
+
+    def update(self, epoch, host_ms):
+        if self._origin is None:
+            self._origin = epoch
+            self._bucket_start = 0
+        x = epoch - self._origin
+        delta = host_ms - epoch
+
+        if x - self._bucket_start >= _ClockEstimate.BUCKET_MS:
+            if self._bucket_min is not None:
+                self._minima.append(self._bucket_min)
+                if len(self._minima) >= 2:
+                    self._fit()
+            self._bucket_start = x
+            self._bucket_min = None
+
+        if self._bucket_min is None or delta < self._bucket_min[1]:
+            self._bucket_min = (x, delta)
+        if len(self._minima) < 2 and (self.offset is None or delta < self.offset):
+            self.offset = delta
+
+    def _fit(self):
+        n = len(self._minima)
+        mean_x = sum(m[0] for m in self._minima) / n
+        mean_y = sum(m[1] for m in self._minima) / n
+        var = sum((m[0] - mean_x) ** 2 for m in self._minima)
+        self.drift = sum((m[0] - mean_x) * (m[1] - mean_y) for m in self._minima) / var if var > 0 else 0.0
+        self.offset = mean_y - self.drift * mean_x
+
+    def align(self, epoch):
+        return epoch + self.offset + self.drift * (epoch - self._origin)
+
+class MergedStream(_DeliveryThread):
+    """
+    Merges data signals from several boards into one time ordered stream.  Each board's epochs are mapped onto the host
+    clock with an estimate of the board clock's offset and drift, and a worker thread merges the per signal queues with a
+    heap based k-way merge.  A sample is emitted once no other signal can still produce an earlier one, or once it has
+    waited for the lookahead, so a slow or silent board delays the stream by at most that long
+    """
+
+    def __init__(self, handler, **kwargs):
+        """
+        Creates a MergedStream object and starts its worker thread
+        @params:
+            handler     - Required  : `(str, float, object) -> void` function called on the worker thread with each sample's
+                                      source name, aligned epoch in milliseconds, and value
+            lookahead   - Optional  : Max seconds a sample waits for samples from slower boards, defaults to 0.1
+            window      - Optional  : Seconds of history used to estimate each board's clock, defaults to 60
+        """
+        _DeliveryThread.__init__(self, handler)
+        self.lookahead = (kwargs['lookahead'] if ('lookahead' in kwargs) else 0.1) * 1000.0
+        self.window = int(kwargs['window'] if ('window' in kwargs) else 60)
+
+        self.received = 0
+        self.late = 0
+
+        self._sources = []
+        self._clocks = {}
+        self._heap = []
+        self._last_emitted = None
+        self._start_worker(self._run)
+
+    def add(self, device, signal, **kwargs):
+        """
+        Subscribes to a data signal and merges its samples into the stream
+        @params:
+            device      - Required  : MetaWear object the signal belongs to, signals of the same board share a clock estimate
+            signal      - Required  : Data signal to subscribe to
+            name        - Optional  : Source name passed to the handler, defaults to the board's mac address
+            n_elem      - Optional  : Same as QueuedDataHandler's n_elem
+        """
+        if device.address not in self._clocks:
+            self._clocks[device.address] = _ClockEstimate(int(self.window * 1000.0 / _ClockEstimate.BUCKET_MS))
+        read_sample = _sample_reader(kwargs)
+
+        source = SimpleNamespace(name = kwargs['name'] if ('name' in kwargs) else device.address, signal = signal,
+                clock = self._clocks[device.address], queue = deque(), last = None, arrived = None)
+
+        def data_handler(ctx, pointer):
+            host_ms = time.time() * 1000.0
+            epoch, value = read_sample(pointer)
+            with self._cond:
+                source.clock.update(epoch, host_ms)
+                aligned = source.clock.align(epoch)
+                # refitting the clock can move a sample before its predecessor, keep each source in order
+                if source.last is not None and aligned < source.last:
+                    aligned = source.last
+                source.last = aligned
+                source.arrived = host_ms
+
+                self.received += 1
+                if len(source.queue) == 0:
+                    heapq.heappush(self._heap, (aligned, source.index))
+                source.queue.append((aligned, host_ms, value))
+                self._cond.notify_all()
+
+        source.callback = FnVoid_VoidP_DataP(data_handler)
+        with self._cond:
+            source.index = len(self._sources)
+            self._sources.append(source)
+        libmetawear.mbl_mw_datasignal_subscribe(signal, None, source.callback)
+        return source.callback
+
+    @property
+    def clocks(self):
+        """
+        Dict of each board's mac address to its estimated clock offset, in milliseconds, and drift, in parts per million
+        """
+        with self._cond:
+            return dict((k, SimpleNamespace(offset = c.offset, drift_ppm = c.drift * 1e6)) for k, c in self._clocks.items())
+
+    def _ready(self, now):
+        """Returns the seconds until the earliest head can be emitted, 0 if it can be emitted now, None if there is nothing to emit"""
+        if len(self._heap) == 0:
+            return None
+        aligned, index = self._heap[0]
+        if self._closed:
+            return 0
+
+        waited = self._sources[index].queue[0][1] + self.lookahead - now
+        if waited <= 0:
+            return 0
+        for s in self._sources:
+            # an empty source's next sample is no earlier than its last one, wait if that could still precede the head
+            if len(s.queue) == 0 and (s.last is None or s.last < aligned):
+                return waited / 1000.0
+        return 0
+
+    def _run(self):
+        while True:
+            batch = []
+            with self._cond:
+                while True:
+                    wait = self._ready(time.time() * 1000.0)
+                    if wait == 0 or (wait is None and self._closed):
+                        break
+                    self._cond.wait(wait)
+
+                now = time.time() * 1000.0
+                while self._ready(now) == 0:
+                    aligned, index = heapq.heappop(self._heap)
+                    source = self._sources[index]
+                    sample = source.queue.popleft()
+                    if len(source.queue) != 0:
+                        heapq.heappush(self._heap, (source.queue[0][0], index))
+
+                    if self._last_emitted is not None and aligned < self._last_emitted:
+                        # arrived after the lookahead passed, emit it with the latest time so the stream stays ordered
+                        self.late += 1
+                        aligned = self._last_emitted
+                    self._last_emitted = aligned
+                    batch.append((source.name, aligned, sample[2]))
+
+                if len(batch) == 0 and self._closed:
+                    return
+
+            self._deliver(batch)
+
+    def close(self, **kwargs):
+        """
+        Unsubscribes from the signals and waits for the worker to emit the buffered samples
+        @params:
+            timeout     - Optional  : Max seconds to wait for the worker to finish, waits indefinitely if not set
+        """
+        for s in self._sources:
+            libmetawear.mbl_mw_datasignal_unsubscribe(s.signal)
+        self._close(kwargs['timeout'] if 'timeout' in kwargs else None)
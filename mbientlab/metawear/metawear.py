@@ -2,22 +2,18 @@ from . import libmetawear
 from .cbindings import *
 from collections import deque
 from ctypes import *
-from distutils.version import LooseVersion
-from mbientlab.warble import Gatt
 from threading import Event
 from types import SimpleNamespace
 
-import copy
 import errno
 import json
 import os
 import platform
-import requests
+import select
+import struct
 import sys
 import time
 import uuid
-import serial
-import serial.tools.list_ports as list_ports
 import threading
 
 _is_linux = platform.system() == 'Linux'
@@ -32,24 +28,64 @@ elif sys.version_info[0] == 3:
     def _array_to_buffer(value):
         return create_string_buffer(bytes(value), len(value))
 
+class _ValueBuffer(object):
+    """Preallocated ctypes buffer that incoming GATT values are copied into before being handed to libmetawear"""
+
+    def __init__(self, size = 256):
+        self._allocate(size)
+
+    def _allocate(self, size):
+        self.raw = (c_ubyte * size)()
+        self.pointer = cast(self.raw, POINTER(c_ubyte))
+        self.size = size
+
+    def load(self, value):
+        """Copies the value into the buffer and returns a pointer to it"""
+        length = len(value)
+        if length > self.size:
+            self._allocate(length)
+        if isinstance(value, bytes):
+            memmove(self.raw, value, length)
+        else:
+            self.raw[0:length] = value
+        return self.pointer
+
 def _gattchar_to_string(gattchar):
     return str(uuid.UUID(int = ((gattchar.uuid_high << 64) | gattchar.uuid_low)))
 
 def _lookup_path(path):
     return path if path is not None else ".metawear"
 
-def _download_file(url, dest):
-    try:
-        os.makedirs(os.path.dirname(dest))
-    except OSError as exception:
-        if exception.errno != errno.EEXIST:
-            raise
-    finally:
-        r = requests.get(url, stream=True)
-        content = r.content
-        with open(dest, "wb") as f:
-            f.write(content)
-        return content
+_STATE_MAGIC = b'MWSC'
+_STATE_VERSION = 1
+# magic, version, info length, cpp state length
+_STATE_HEADER = struct.Struct('<4sB3xII')
+
+def _write_state_cache(path, info, state):
+    """Atomically writes the board info and serialized C++ state to the binary cache file"""
+    info_bytes = json.dumps(info).encode('utf8')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, "wb") as f:
+        f.write(_STATE_HEADER.pack(_STATE_MAGIC, _STATE_VERSION, len(info_bytes), len(state)))
+        f.write(info_bytes)
+        f.write(state)
+    os.replace(tmp_path, path)
+
+def _read_state_cache(path):
+    """Reads a binary cache file with a single read, returning the info dict, the file content, and the offset and length of the C++ state"""
+    with open(path, "rb") as f:
+        content = f.read()
+
+    if len(content) < _STATE_HEADER.size:
+        raise ValueError("Truncated state cache '%s'" % (path))
+    magic, version, info_len, state_len = _STATE_HEADER.unpack_from(content)
+    if magic != _STATE_MAGIC or version != _STATE_VERSION:
+        raise ValueError("Unrecognized state cache '%s'" % (path))
+
+    offset = _STATE_HEADER.size + info_len
+    if len(content) < offset + state_len:
+        raise ValueError("Truncated state cache '%s'" % (path))
+    return json.loads(content[_STATE_HEADER.size:offset].decode('utf8')), content, offset, state_len
 
 class MetaWearUSB(object):
     """Enables USB control of MetaWear devices via a warble-like abstraction"""
@@ -59,37 +95,110 @@ class MetaWearUSB(object):
     GATT_MW_CHAR_NOTIFICATION = '326a9006-85cb-9195-d9dd-464cfbbae75a'
 
     SERIAL_XFER_SIZE =          1024
+    # seconds a blocked read waits before checking if the read thread should stop
+    SERIAL_READ_TIMEOUT =       0.1
     SERIAL_BYTE_START =         b'\x1f'
     SERIAL_BYTE_STOP =          b'\n'
 
+    # commands are written and completed in the order they are queued, so writes with response need not wait for the 
+    # previous one to complete
+    ordered_writes =            True
+
+    # seconds a scan result is reused for, udev adding or removing a link in SERIAL_BY_ID invalidates it sooner
+    SCAN_CACHE_TTL =            2.0
+    SERIAL_BY_ID =              '/dev/serial/by-id'
+
+    _scan_lock = threading.Lock()
+    _scan_cache = None
+
+    @staticmethod
+    def _udev_stamp():
+        try:
+            return os.stat(MetaWearUSB.SERIAL_BY_ID).st_mtime
+        except OSError:
+            return None
+
+    @staticmethod
+    def _scan_devices(**kwargs):
+        """Returns the attached devices keyed by serial number, i.e. the mac address, rescanning the ports if the cached result is stale"""
+        with MetaWearUSB._scan_lock:
+            stamp = MetaWearUSB._udev_stamp()
+            cache = MetaWearUSB._scan_cache
+            if ('refresh' not in kwargs or not kwargs['refresh']) and cache is not None and cache[1] == stamp and \
+                    time.time() - cache[0] < MetaWearUSB.SCAN_CACHE_TTL:
+                return cache[2]
+
+            import serial.tools.list_ports as list_ports
+
+            devices = {}
+            for port in list_ports.grep('VID:PID=1915:D978'):
+                name = 'MetaMotionS' if port.product is None else port.product
+                mac = ':'.join(port.serial_number[i:i+2] for i in range(0,len(port.serial_number),2))
+                devices[mac] = {'address': mac, 'name': name, 'path': port.device}
+            MetaWearUSB._scan_cache = (time.time(), stamp, devices)
+            return devices
+
+    @staticmethod
+    def invalidate_scan():
+        """Discards the cached scan result so the next lookup rescans the USB ports"""
+        with MetaWearUSB._scan_lock:
+            MetaWearUSB._scan_cache = None
+
+    @staticmethod
+    def scan(**kwargs):
+        """
+        List MetaWear devices attached to USB.  Results are cached for SCAN_CACHE_TTL seconds, or until devices are 
+        added or removed if udev maintains SERIAL_BY_ID
+        @params:
+            refresh     - Optional  : Rescan the ports even if the cached result is still valid, defaults to false
+        """
+        return [dict(d) for d in MetaWearUSB._scan_devices(**kwargs).values()]
+
     @staticmethod
-    def scan():
-        """List MetaWear devices attached to USB"""
-        devices = []
-        for port in list_ports.grep('VID:PID=1915:D978'):
-            name = 'MetaMotionS' if port.product is None else port.product
-            mac = ':'.join(port.serial_number[i:i+2] for i in range(0,len(port.serial_number),2))
-            devices.append({'address': mac, 'name': name, 'path': port.device})
-        return devices
+    def resolve(addresses):
+        """
+        Looks up the OS paths of many devices with a single scan, returns a dict mapping each address to its path, or 
+        None if the device is not attached to USB
+        @params:
+            addresses   - Required  : List of mac addresses
+        """
+        devices = MetaWearUSB._scan_devices()
+        return dict((a, devices[a.upper()]['path'] if a.upper() in devices else None) for a in addresses)
 
     @staticmethod
     def _device_path(address):
         """Returns OS path of device with given address if attached to USB"""
-        devices = MetaWearUSB.scan()
-        for d in devices:
-            if address == d['address']:
-                return d['path']
-        return None
+        devices = MetaWearUSB._scan_devices()
+        return devices[address]['path'] if address in devices else None
 
-    def __init__(self, address):
+    def __init__(self, address, **kwargs):
+        """
+        Creates a MetaWearUSB object
+        @params:
+            address         - Required  : Mac address of the board
+            read_chunk_size - Optional  : Max number of bytes read from the serial port at once, defaults to 4096
+            read_latency    - Optional  : Seconds to wait after data arrives so more of it can be read in the same chunk, 
+                                          trades notification latency for fewer wakeups under load, defaults to 0
+        """
+        self.read_chunk_size = kwargs['read_chunk_size'] if ('read_chunk_size' in kwargs) else 4096
+        self.read_latency = kwargs['read_latency'] if ('read_latency' in kwargs) else 0.0
         self._notify_handler = None
         self._disconnect_handler = None
 
         self.address = address
         self.ser = None
+        self._read_buffer = bytearray()
+        self._resync_count = 0
+
+        self._write_cond = threading.Condition()
+        self._write_queue = deque()
+        self._write_poll = False
+        self._write_disconnect = False
 
     def connect_async(self, handler):
         """Connect to device by establishing USB serial comm link"""
+        import serial
+
         status = None
         try:
             self.ser = serial.Serial(MetaWearUSB._device_path(self.address), 1000000, timeout=.1)
@@ -109,8 +218,7 @@ class MetaWearUSB(object):
 
             self._write_disconnect = False
             self._write_poll = True
-            self._write_resp_handler = None
-            self._write_resp_event = Event() 
+            self._write_queue = deque()
             self._write_thread = threading.Thread(target=self._write_poller, daemon=True)
 
             self._read_thread.start()
@@ -118,6 +226,7 @@ class MetaWearUSB(object):
 
         except serial.SerialException:
             self.ser = None
+            MetaWearUSB.invalidate_scan()
             status = Const.STATUS_ERROR_TIMEOUT
 
         handler(status)
@@ -143,8 +252,9 @@ class MetaWearUSB(object):
                 self._read_thread.join()
 
             if self._write_poll:
-                self._write_poll = False
-                self._write_resp_event.set()
+                with self._write_cond:
+                    self._write_poll = False
+                    self._write_cond.notify()
                 self._write_thread.join()
 
             self.ser.close()
@@ -153,23 +263,27 @@ class MetaWearUSB(object):
         if self._disconnect_handler is not None:
             self._disconnect_handler(Const.STATUS_OK)
 
-    def _write(self, cmd_str):
-        """Encodes MetaWear command with serial line protocol."""
-        bin_str = [0x1f, len(cmd_str)] + cmd_str + [ord('\n')]
-        self.ser.write(bin_str)
-        if cmd_str == list(map(ord, '\xfe\x06')): # disconnect cmd, flush and close serial port
-            self._write_disconnect = True
-            self._write_resp_event.set()
+    def _write(self, cmd_str, handler):
+        """
+        Encodes MetaWear command with serial line protocol and appends a (frame, handler) entry to the write queue.  
+        Entries queued before the write thread wakes up are sent with a single write and flush, and their handlers are 
+        called in queued order
+        """
+        cmd_str = bytes(cmd_str)
+        frame = MetaWearUSB.SERIAL_BYTE_START + bytes([len(cmd_str)]) + cmd_str + MetaWearUSB.SERIAL_BYTE_STOP
+        with self._write_cond:
+            self._write_queue.append((frame, handler))
+            if cmd_str == b'\xfe\x06': # disconnect cmd, flush and close serial port
+                self._write_disconnect = True
+            self._write_cond.notify()
 
     def _write_async(self, cmd_str, handler):
         """Async write with response"""
-        self._write(cmd_str)
-        self._write_resp_handler = handler
-        self._write_resp_event.set()
+        self._write(cmd_str, handler)
 
     def _write_without_resp_async(self, cmd_str, handler):
         """Async write without response"""
-        self._write(cmd_str)
+        self._write(cmd_str, None)
         handler(None)
     
     def service_exists(self, uuid):
@@ -198,61 +312,128 @@ class MetaWearUSB(object):
         """Registers disconnect handler"""
         self._disconnect_handler = handler
 
-    def _bin_cmd_decode(self, c):
-        """Decodes MetaWear event from line protocol character by character"""
-        if self._cmd_started:
-            if self._cmd_len == 0:
-                self._cmd_len = ord(c)
-            elif self._cmd_recv_len < self._cmd_len:
-                self._cmd_recv_len += 1
-                self._cmd_buffer += c
-            elif c == MetaWearUSB.SERIAL_BYTE_STOP:
-                self._cmd_started = False
-                return self._cmd_buffer
-        elif c == MetaWearUSB.SERIAL_BYTE_START:
-            self._cmd_started = True
-            self._cmd_len = 0
-            self._cmd_recv_len = 0
-            self._cmd_buffer = []
-        return []
+    def _decode_frames(self, data):
+        """Appends received bytes to the frame buffer and returns the complete frames it holds"""
+        buffer = self._read_buffer
+        buffer += data
+
+        frames = []
+        view = memoryview(buffer)
+        size = len(buffer)
+        pos = 0
+        while True:
+            start = buffer.find(MetaWearUSB.SERIAL_BYTE_START, pos)
+            if start < 0:
+                pos = size
+                break
+            end = start + 2 + (buffer[start + 1] if start + 1 < size else 0)
+            if end >= size:
+                pos = start
+                break
+            if buffer[end] == MetaWearUSB.SERIAL_BYTE_STOP[0]:
+                # zero length frames carry nothing for libmetawear
+                if end > start + 2:
+                    frames.append(bytes(view[start + 2:end]))
+                pos = end + 1
+            else:
+                # corrupt frame, resync on the next start byte
+                self._resync_count += 1
+                pos = start + 1
+        view.release()
+
+        del buffer[:pos]
+        return frames
+
+    def _read_chunk(self, fd):
+        """
+        Blocks until serial data is available, or SERIAL_READ_TIMEOUT passes, then reads up to read_chunk_size bytes.  
+        Waits on the port's file descriptor with select when there is one, otherwise polls in_waiting with the port's 
+        read timeout, e.g. on Windows
+        """
+        if fd is None:
+            return self.ser.read(max(1, min(self.read_chunk_size, self.ser.in_waiting)))
+
+        ready = select.select([fd], [], [], MetaWearUSB.SERIAL_READ_TIMEOUT)[0]
+        if len(ready) == 0:
+            return b''
+        if self.read_latency > 0:
+            time.sleep(self.read_latency)
+        try:
+            data = os.read(fd, self.read_chunk_size)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return b''
+            raise
+        if len(data) == 0:
+            # readable but no data means the device was unplugged
+            import serial
+            raise serial.SerialException("device disconnected")
+        return data
 
     def _read_poller(self):
         """Read polling loop to convert synchronous serial operations to async notifications."""
-        self._cmd_started = False
+        import serial
+
+        self._read_buffer = bytearray()
+        try:
+            fd = self.ser.fileno() if platform.system() != 'Windows' else None
+        except (AttributeError, ValueError, OSError):
+            fd = None
+
         while self._read_poll:
             try:
-                read_len = max(1, min(MetaWearUSB.SERIAL_XFER_SIZE, self.ser.in_waiting))
-                line_bytes = self.ser.read(read_len)
-            except serial.SerialException:
+                line_bytes = self._read_chunk(fd)
+            except (serial.SerialException, OSError):
                 self._read_poll = False
                 self.disconnect()
                 return
 
             if len(line_bytes) < 1:
                 continue
-            for i in range(len(line_bytes)):
-                cmd = self._bin_cmd_decode(line_bytes[i:i+1])
-                if len(cmd) > 0:
-                    if self._notify_handler is not None:
-                        self._notify_handler(cmd)
+            for cmd in self._decode_frames(line_bytes):
+                if self._notify_handler is not None:
+                    self._notify_handler(cmd)
+
+    def _write_batch(self, entries):
+        """Writes and flushes the frames of the dequeued entries then calls their handlers in order, returns the serial error if any"""
+        import serial
+
+        error = None
+        try:
+            self.ser.write(b''.join(e[0] for e in entries))
+            self.ser.flush()
+        except serial.SerialException as e:
+            error = e
+        for frame, handler in entries:
+            if handler is not None:
+                handler(error)
+        return error
 
     def _write_poller(self):
         """Write poller enabling async writes and write response callbacks."""
-        while self._write_poll:
-            self._write_resp_event.wait() 
-            self._write_resp_event.clear()
-            if not self._write_poll:
-                return
-            self.ser.flush()
-            if self._write_resp_handler is not None:
-                self._write_resp_handler(None)
-                self._write_resp_handler = None
-            if self._write_disconnect:
+        while True:
+            with self._write_cond:
+                while self._write_poll and len(self._write_queue) == 0:
+                    self._write_cond.wait()
+                if not self._write_poll:
+                    return
+                entries = list(self._write_queue)
+                self._write_queue.clear()
+                disconnect = self._write_disconnect
+
+            if self._write_batch(entries) is not None or disconnect:
                 self._write_poll = False
                 self.disconnect()
+                return
         
 class MetaWear(object):
     GATT_SERVICE = "326a9000-85cb-9195-d9dd-464cfbbae75a"
+    # name: (min connection interval ms, max connection interval ms, slave latency, supervision timeout ms)
+    CONNECTION_PROFILES = {
+        "download": (7.5, 7.5, 0, 6000),
+        "stream": (7.5, 11.25, 0, 6000),
+        "idle": (100.0, 200.0, 4, 6000)
+    }
     _DEV_INFO = {
         "00002a27-0000-1000-8000-00805f9b34fb": "hardware",
         "00002a29-0000-1000-8000-00805f9b34fb": "manufacturer",
@@ -273,20 +454,46 @@ class MetaWear(object):
             cache_path  - Optional  : Path the SDK uses for cached data, defaults to '.metawear' in the local directory
             hci_mac     - Optional  : Mac address of the hci device to uses, Warble will pick one if not set
             deserialize - Optional  : Deserialize the cached C++ SDK state if available, defaults to true
+            max_in_flight_writes    - Optional  : Max number of write without response commands dispatched before their 
+                                                  completion is reported, defaults to 1
+            transport   - Optional  : Object with the same interface as MetaWearUSB to use in place of the BLE and USB 
+                                      connections, such as a simulated board
+            usb_args    - Optional  : Dict of additional MetaWearUSB arguments, e.g. read_chunk_size and read_latency
+            firmware_cache          - Optional  : mbientlab.metawear.firmware.FirmwareCache object to share between boards, 
+                                                  defaults to a cache in cache_path
+            metrics     - Optional  : Collect throughput counters and latency histograms, see `metrics_snapshot`, defaults to false
         """
-        args = {}
-        if (_is_linux and 'hci_mac' in kwargs):
-            args['hci'] = kwargs['hci_mac']
-        self.warble = Gatt(address.upper(), **args)
-        self.conn = self.warble
+        self.transport = kwargs['transport'] if ('transport' in kwargs) else None
+        if self.transport is None:
+            args = {}
+            if (_is_linux and 'hci_mac' in kwargs):
+                args['hci'] = kwargs['hci_mac']
+            from mbientlab.warble import Gatt
+            self.warble = Gatt(address.upper(), **args)
+        else:
+            self.warble = None
+        self.conn = self.warble if self.transport is None else self.transport
 
-        self.usb = MetaWearUSB(address.upper())
+        self.usb = MetaWearUSB(address.upper(), **(kwargs['usb_args'] if ('usb_args' in kwargs) else {}))
 
         self.info = {}
         self.write_queue = deque([])
+        self.max_in_flight_writes = kwargs['max_in_flight_writes'] if ('max_in_flight_writes' in kwargs) else 1
+        self._write_lock = threading.Lock()
+        self._write_idle = threading.Condition(self._write_lock)
+        self._write_draining = False
+        self._write_in_flight = 0
+        self._write_resp_in_flight = False
+        self._write_generation = 0
+        self._notify_buffers = {}
+        self._trace = None
+        self.metrics = None
+        self.connection_timings = {}
+        self.connection_profile = None
         self.on_disconnect = None
         self.address = address.upper()
         self.cache = kwargs['cache_path'] if ('cache_path' in kwargs) else ".metawear"
+        self.firmware_cache = kwargs['firmware_cache'] if ('firmware_cache' in kwargs) else None
 
         self._write_fn= FnVoid_VoidP_VoidP_GattCharWriteType_GattCharP_UByteP_UByte(self._write_gatt_char)
         self._read_fn= FnVoid_VoidP_VoidP_GattCharP_FnIntVoidPtrArray(self._read_gatt_char)
@@ -300,6 +507,8 @@ class MetaWear(object):
 
         if 'deserialize' not in kwargs or kwargs['deserialize']:
             self.deserialize()
+        if 'metrics' in kwargs and kwargs['metrics']:
+            self.enable_metrics()
 
         try:
             os.makedirs(self.cache)
@@ -337,11 +546,13 @@ class MetaWear(object):
         """
 
         def completed(err):
+            self.connection_timings['link'] = time.time() - start
             if (err != None):
                 handler(err)
             else:
                 if not self.in_metaboot_mode:
                     def init_handler(context, device, status):
+                        self.connection_timings['initialize'] = time.time() - init_start
                         if status != Const.STATUS_OK:
                             self.disconnect()
                             handler(RuntimeError("Error initializing the API (%d)" % (status)))
@@ -351,6 +562,8 @@ class MetaWear(object):
                             handler(None)
 
                     self._init_handler = FnVoid_VoidP_VoidP_Int(init_handler)
+                    init_start = time.time()
+                    self._reset_writes()
                     libmetawear.mbl_mw_metawearboard_initialize(self.board, None, self._init_handler)
                 else:
                     def read_task():
@@ -385,8 +598,13 @@ class MetaWear(object):
                     read_task()
 
         if 'firmware' in self.info: del self.info['firmware']
+        self.connection_timings = {}
         
-        self.conn = self.usb if self.usb.is_enumerated else self.warble
+        if self.transport is not None:
+            self.conn = self.transport
+        else:
+            self.conn = self.usb if self.usb.is_enumerated else self.warble
+        start = time.time()
         self.conn.connect_async(completed)
 
     def connect(self, **kwargs):
@@ -406,6 +624,89 @@ class MetaWear(object):
         if (result[0] != None):
             raise result[0]
 
+    def set_connection_profile(self, profile, **kwargs):
+        """
+        Applies a set of connection parameters and waits for them to take effect.  If the transport reports connection 
+        parameter updates, i.e. has an `on_connection_parameters_updated` method, the function waits for that event, 
+        otherwise it waits until the command has been written to the board then gives the central time to renegotiate the 
+        link.  Returns False if the timeout passed first
+        @params:
+            profile     - Required  : Name of a CONNECTION_PROFILES entry, e.g. 'download', 'stream', or 'idle', or a 
+                                      (min interval, max interval, latency, timeout) tuple
+            timeout     - Optional  : Seconds to wait, defaults to 2.0
+            settle      - Optional  : Seconds to sleep once the command is written when the transport does not report 
+                                      parameter updates, defaults to 1.0
+        """
+        if isinstance(profile, (tuple, list)):
+            params = tuple(profile)
+        elif profile in MetaWear.CONNECTION_PROFILES:
+            params = MetaWear.CONNECTION_PROFILES[profile]
+        else:
+            raise ValueError("Unknown connection profile '%s'" % (profile))
+        timeout = kwargs['timeout'] if ('timeout' in kwargs) else 2.0
+        settle = kwargs['settle'] if ('settle' in kwargs) else 1.0
+        deadline = time.time() + timeout
+
+        updated = Event()
+        on_updated = getattr(self.conn, 'on_connection_parameters_updated', None)
+        if on_updated is not None:
+            on_updated(lambda *args: updated.set())
+
+        try:
+            libmetawear.mbl_mw_settings_set_connection_parameters(self.board, *params)
+            applied = self._wait_for_writes(timeout)
+            if applied and on_updated is not None:
+                applied = updated.wait(max(0.0, deadline - time.time()))
+            elif applied and settle > 0:
+                # the command is on the wire but the link may still be using the old parameters
+                time.sleep(settle)
+        finally:
+            if on_updated is not None:
+                on_updated(None)
+
+        if applied:
+            self.connection_profile = profile
+        return applied
+
+    def download_log_async(self, handler, **kwargs):
+        """
+        Downloads the entries of every active logger on the board, whether or not it was created by this host.  Entries are 
+        decoded into columns as they arrive and written out by the writer from a separate thread
+        @params:
+            handler             - Required  : `(SimpleNamespace, BaseException) -> void` function to handle the result of the task.  The 
+                                              result has the number of entries written, number of entries skipped because they 
+                                              could not be decoded, elapsed seconds, entries_per_sec, and the output paths
+            writer              - Optional  : Object with `write(identifier, fields, chunk)` and `close()` methods, defaults to a 
+                                              CsvLogWriter writing to the current directory
+            n_notifies          - Optional  : Number of progress updates to receive, defaults to 100
+            progress_handler    - Optional  : `(int, int, float) -> void` function called with the entries left, total entries, 
+                                              and entries per second
+            flush_interval      - Optional  : Seconds between draining decoded entries to the writer, defaults to 0.25
+            profile             - Optional  : Connection profile used during the download.  The previous profile, or the 
+                                              parameters the transport reported if none was set, is restored afterwards.  
+                                              None leaves the connection alone.  Defaults to 'download'
+        """
+        from .logdownload import LogDownload
+        LogDownload(self, **kwargs).start(handler)
+
+    def download_log(self, **kwargs):
+        """
+        Synchronous variant of `download_log_async`, returns the download result
+        """
+        e = Event()
+        result = []
+
+        def completed(value, error):
+            result.append((value, error))
+            e.set()
+
+        self.download_log_async(completed, **kwargs)
+        e.wait()
+
+        if (result[0][1] != None):
+            raise result[0][1]
+        return result[0][0]
+
     def _read_gatt_char(self, context, caller, ptr_gattchar, handler):
         uuid = _gattchar_to_string(ptr_gattchar.contents)
 
@@ -419,36 +720,155 @@ class MetaWear(object):
                 read_value = bytearray(value)
                 self.info[MetaWear._DEV_INFO[uuid]] = read_value.decode('utf8')
 
+                if self._trace is not None:
+                    self._trace.read(uuid, value)
+                if self.metrics is not None:
+                    self.metrics.bytes_in += len(value)
                 handler(caller, cast(_array_to_buffer(value), POINTER(c_ubyte)), len(value))
             else:
                 print("%s: Error reading gatt char (%s)" % (gatt_char.uuid, error))
 
         gatt_char.read_value_async(completed)
-        
-    def _write_char_async(self, force):
-        count = len(self.write_queue)
-        if (count > 0 and (force or count == 1)):
-            next = self.write_queue[0]
 
-            def completed(err):
-                if (err != None):
-                    print(str(err))
-                temp = self.write_queue.popleft()
-                self._write_char_async(True)
+    def enable_metrics(self):
+        """
+        Starts collecting throughput counters and latency histograms, resetting them if they were already enabled
+        """
+        from .metrics import Metrics
+        self.metrics = Metrics()
+
+    def disable_metrics(self):
+        """
+        Stops collecting metrics.  The disabled hot paths only check if the metrics attribute is None
+        """
+        self.metrics = None
 
-            if (next[2] == GattCharWriteType.WITH_RESPONSE):
-                next[0].write_async(next[1], completed)
+    def metrics_snapshot(self):
+        """
+        Returns a dict of the collected metrics, e.g. notifications_per_sec, bytes_in, bytes_out, write_queue_depth, the 
+        write_queue_time and callback_time histograms, usb_resync_count, and the connection phase durations.  Pass the 
+        result to mbientlab.metawear.metrics.to_prometheus for the Prometheus text format.  Returns None if metrics 
+        are not enabled
+        """
+        metrics = self.metrics
+        if metrics is None:
+            return None
+        return metrics.snapshot(gauges = {
+            'write_queue_depth': len(self.write_queue),
+            'usb_resync_count': self.usb._resync_count,
+            'connection_phases': dict(self.connection_timings)
+        })
+
+    def start_recording(self, path):
+        """
+        Records the raw GATT traffic between the SDK and the board, i.e. writes, reads, and notifications, to a binary 
+        trace file that can be played back with mbientlab.metawear.trace.TraceReplay
+        @params:
+            path        - Required  : Path of the trace file to create
+        """
+        from .trace import TraceWriter
+        self.stop_recording()
+        self._trace = TraceWriter(path, self.address)
+
+    def stop_recording(self):
+        """
+        Stops recording GATT traffic and closes the trace file
+        """
+        trace = self._trace
+        self._trace = None
+        if trace is not None:
+            trace.close()
+
+    def _next_write(self):
+        """
+        Pops the next queued write if the in-flight limits allow it to be dispatched, must hold _write_lock.  Transports 
+        with ordered_writes set, e.g. MetaWearUSB, keep their own FIFO so the limits do not apply to them
+        """
+        if len(self.write_queue) == 0 or self._write_resp_in_flight:
+            return None
+        if not getattr(self.conn, 'ordered_writes', False):
+            if self.write_queue[0][2] == GattCharWriteType.WITH_RESPONSE:
+                if self._write_in_flight > 0:
+                    return None
+                self._write_resp_in_flight = True
+            elif self._write_in_flight >= self.max_in_flight_writes:
+                return None
+
+        self._write_in_flight += 1
+        return self.write_queue.popleft()
+
+    def _reset_writes(self):
+        """
+        Drops queued writes and forgets the in-flight ones, whose completions may never arrive once the link is gone.  
+        Completions of writes dispatched before the reset are ignored
+        """
+        with self._write_lock:
+            self.write_queue.clear()
+            self._write_in_flight = 0
+            self._write_resp_in_flight = False
+            self._write_generation += 1
+            self._write_idle.notify_all()
+
+    def _write_completed(self, err, write_type, generation):
+        if (err != None):
+            print(str(err))
+        with self._write_lock:
+            if generation != self._write_generation:
+                return
+            self._write_in_flight -= 1
+            if write_type == GattCharWriteType.WITH_RESPONSE:
+                self._write_resp_in_flight = False
+            if self._write_in_flight == 0 and len(self.write_queue) == 0:
+                self._write_idle.notify_all()
+        self._drain_write_queue()
+
+    def _wait_for_writes(self, timeout):
+        """Blocks until every queued write has completed, returns False if the timeout passed first"""
+        with self._write_idle:
+            return self._write_idle.wait_for(lambda: self._write_in_flight == 0 and len(self.write_queue) == 0, timeout)
+
+    def _drain_write_queue(self):
+        """
+        Dispatches queued writes until the queue is empty or the in-flight limits are reached.  Completion callbacks 
+        that fire while the queue is being drained only update the counters, leaving the dispatching to the active loop
+        """
+        with self._write_lock:
+            if self._write_draining:
+                return
+            self._write_draining = True
+
+        while True:
+            with self._write_lock:
+                next = self._next_write()
+                if next is None:
+                    self._write_draining = False
+                    return
+                generation = self._write_generation
+
+            gatt_char, value, write_type, queued = next
+            if queued is not None and self.metrics is not None:
+                self.metrics.write_queue_time.observe(time.time() - queued)
+            completed = lambda err, write_type = write_type, generation = generation: self._write_completed(err, write_type, generation)
+            if (write_type == GattCharWriteType.WITH_RESPONSE):
+                gatt_char.write_async(value, completed)
             else:
-                next[0].write_without_resp_async(next[1], completed)
+                gatt_char.write_without_resp_async(value, completed)
 
     def _write_gatt_char(self, context, caller, write_type, ptr_gattchar, value, length):
-        gatt_char = self.conn.find_characteristic(_gattchar_to_string(ptr_gattchar.contents))
-        buffer = [value[i] for i in range(0, length)]
+        uuid = _gattchar_to_string(ptr_gattchar.contents)
+        gatt_char = self.conn.find_characteristic(uuid)
+        value = string_at(value, length)
+
+        if self._trace is not None:
+            self._trace.write(uuid, value, write_type == GattCharWriteType.WITH_RESPONSE)
+        metrics = self.metrics
+        with self._write_lock:
+            self.write_queue.append((gatt_char, value, write_type, None if metrics is None else time.time()))
+            if metrics is not None:
+                metrics.queued(length, len(self.write_queue))
+
+        self._drain_write_queue()
 
-        self.write_queue.append([gatt_char, buffer, write_type])
-        
-        self._write_char_async(False)
-        
     def _enable_notifications(self, context, caller, ptr_gattchar, handler, ready):
         uuid = _gattchar_to_string(ptr_gattchar.contents)
         gatt_char = self.conn.find_characteristic(uuid)
@@ -461,94 +881,94 @@ class MetaWear(object):
                     print(str(err))
                     ready(caller, Const.STATUS_ERROR_ENABLE_NOTIFY)
                 else:
-                    gatt_char.on_notification_received(lambda value: handler(caller, cast(_array_to_buffer(value), POINTER(c_ubyte)), len(value)))
+                    if uuid not in self._notify_buffers:
+                        self._notify_buffers[uuid] = _ValueBuffer()
+                    buffer = self._notify_buffers[uuid]
+
+                    def notification_received(value):
+                        if self._trace is not None:
+                            self._trace.notify(uuid, value)
+                        metrics = self.metrics
+                        if metrics is None:
+                            handler(caller, buffer.load(value), len(value))
+                        else:
+                            start = time.time()
+                            handler(caller, buffer.load(value), len(value))
+                            metrics.notified(len(value), time.time() - start)
+                    gatt_char.on_notification_received(notification_received)
                     ready(caller, Const.STATUS_OK)
 
             gatt_char.enable_notifications_async(completed)
 
     def _on_disconnect(self, context, caller, handler):
         def event_handler(status):
+            self._reset_writes()
             if (self.on_disconnect != None):
                 self.on_disconnect(status)
             handler(caller, status)
         self.conn.on_disconnect(event_handler)
 
     def _download_firmware(self, version=None):
-        firmware_root = os.path.join(self.cache, "firmware")
+        if self.firmware_cache is None:
+            from .firmware import FirmwareCache
+            self.firmware_cache = FirmwareCache(os.path.join(self.cache, "firmware"))
+        return self.firmware_cache.fetch(self.info['hardware'], self.info['model'], version = version)
 
-        info1 = os.path.join(firmware_root, "info1.json")
-        if not os.path.isfile(info1) or (time.time() - os.path.getmtime(info1)) > 1800.0:
-            info1_content = json.loads(_download_file("https://releases.mbientlab.com/metawear/info1.json", info1))
-        else:
-            with open(info1, "rb") as f:
-                info1_content = json.load(f)
-
-        if version is None:
-            versions = []
-            for k in info1_content[self.info['hardware']][self.info['model']]["vanilla"].keys():
-                versions.append(LooseVersion(k))
-            versions.sort()
-            target = str(versions[-1])
-        else:
-            if version not in info1_content[self.info['hardware']][self.info['model']]["vanilla"]:
-                raise ValueError("Firmware '%s' not available for this board" % (version))
-            target = version
-
-        filename = info1_content[self.info['hardware']][self.info['model']]["vanilla"][target]["filename"]
-        local_path = os.path.join(firmware_root, self.info['hardware'], self.info['model'], "vanilla", target, filename)
-
-        if not os.path.isfile(local_path):
-            url = "https://releases.mbientlab.com/metawear/{}/{}/{}/{}/{}".format(
-                self.info['hardware'], self.info['model'], "vanilla", target, filename
-            )
-            _download_file(url, local_path)
-        return local_path
+    def _state_path(self, ext):
+        return os.path.join(self.cache, '%s.%s' % (self.address.replace(':',''), ext))
 
     def serialize(self):
         """
         Serialize and cache the SDK state
         """
-        mac_str = self.address.replace(':','')
-        path = os.path.join(self.cache, '%s.json' % (mac_str))
-
-        state = { "info": copy.deepcopy(self.info) }
-
         size = c_uint(0)
-        cpp_state = cast(libmetawear.mbl_mw_metawearboard_serialize(self.board, byref(size)), POINTER(c_ubyte * size.value))
-        state["cpp_state"] = [cpp_state.contents[i] for i in range(0, size.value)]
+        cpp_state = libmetawear.mbl_mw_metawearboard_serialize(self.board, byref(size))
+        state = string_at(cpp_state, size.value)
         libmetawear.mbl_mw_memory_free(cpp_state)
 
-        with open(path, "w") as f:
-            f.write(json.dumps(state, indent=2))
+        _write_state_cache(self._state_path('mwc'), self.info, state)
         
     def deserialize(self):
         """
         Deserialize the cached SDK state
         """
-        mac_str = self.address.replace(':','')
+        path = self._state_path('mwc')
+        if os.path.isfile(path):
+            try:
+                info, content, offset, length = _read_state_cache(path)
+            except ValueError:
+                os.remove(path)
+            else:
+                self.info = info
+                raw = (c_ubyte * length).from_buffer_copy(content, offset)
+                libmetawear.mbl_mw_metawearboard_deserialize(self.board, raw, length)
+                return True
 
-        # See if old serialized state exists, if it does, read that then remove it
-        path = os.path.join(self.cache, '%s.bin' % (mac_str))
+        # See if old serialized state exists, if it does, migrate it to the binary cache then remove it
+        path = self._state_path('bin')
         if os.path.isfile(path):
             with(open(path, "rb")) as f:
                 content = f.read()
-                raw = (c_ubyte * len(content)).from_buffer_copy(content)
-                libmetawear.mbl_mw_metawearboard_deserialize(self.board, raw, len(content))
-
-            os.remove(path)
+            self._migrate_state(content, path)
             return True
 
-        path = os.path.join(self.cache, '%s.json' % (mac_str))
+        path = self._state_path('json')
         if os.path.isfile(path):
             with(open(path, "r")) as f:
                 content = json.loads(f.read())
-                self.info = content["info"]
-                raw = (c_ubyte * len(content["cpp_state"])).from_buffer_copy(bytearray(content["cpp_state"]))
-                libmetawear.mbl_mw_metawearboard_deserialize(self.board, raw, len(content))
+            self.info = content["info"]
+            self._migrate_state(bytes(bytearray(content["cpp_state"])), path)
             return True
 
         return False
 
+    def _migrate_state(self, content, old_path):
+        raw = (c_ubyte * len(content)).from_buffer_copy(content)
+        libmetawear.mbl_mw_metawearboard_deserialize(self.board, raw, len(content))
+
+        _write_state_cache(self._state_path('mwc'), self.info, content)
+        os.remove(old_path)
+
     def update_firmware_async(self, handler, **kwargs):
         """
         Updates the firmware on the device.  The function is asynchronous and will update the caller 
@@ -557,48 +977,18 @@ class MetaWear(object):
         @params:
             handler             - Required  : `(BaseException) -> void` function to handle the result of the task
             progress_handler    - Optional  : `(int) -> void` function to handle progress updates
+            throughput_handler  - Optional  : `(int, int, float, float) -> void` function called with the bytes sent, total 
+                                              bytes, bytes per second, and estimated seconds left
             version             - Optional  : Specific firmware version to update to, defaults to latest available version
+            retries             - Optional  : Number of times a dropped or stalled transfer is restarted from MetaBoot mode, defaults to 2
+            timeout             - Optional  : Seconds to wait for the board to reset, reconnect, or make transfer progress, defaults to 30.0
         """
-        if not self.in_metaboot_mode:
-            dc_copy = self.on_disconnect
-
-            e = Event()
-            self.on_disconnect = lambda status: e.set()
-
-            libmetawear.mbl_mw_debug_jump_to_bootloader(self.board)
-            e.wait()
-
-            self.on_disconnect = dc_copy
-
-            try:
-                self.connect()
-                if not self.in_metaboot_mode:
-                    handler(RuntimeError("DFU service not found"))
-            except BaseException as err:
-                handler(err)
-                return
-
-        self._progress_handler = None if 'progress_handler' not in kwargs else kwargs['progress_handler']
-
-        def completed(ctx):
-            time.sleep(5.0)
-            handler(None)
+        from .dfu import FirmwareUpdate
+        FirmwareUpdate(self, **kwargs).start(handler)
 
-        self._on_successful = FnVoid_VoidP(completed)
-        self._on_transfer = FnVoid_VoidP_Int(self._dfu_progress)
-        self._on_started = FnVoid_VoidP(lambda ctx: None)
-        self._on_cancelled = FnVoid_VoidP(lambda ctx: self._dfu_error("DFU operation cancelled"))
-        self._on_error = FnVoid_VoidP_charP(lambda ctx, msg: self._dfu_handler(RuntimeError(msg)))
-
-        try:
-            path = self._download_firmware() if 'version' not in kwargs else self._download_firmware(version = kwargs['version'])
-            buffer = create_string_buffer(path.encode('ascii'))
-            self._dfu_delegate = DfuDelegate(context = None, on_dfu_started = self._on_started, on_dfu_cancelled = self._on_cancelled, 
-                    on_transfer_percentage = self._on_transfer, on_successful_file_transferred = self._on_successful, on_error = self._on_error)
-            libmetawear.mbl_mw_metawearboard_perform_dfu(self.board, byref(self._dfu_delegate), buffer.raw)
-        except ValueError as e:
-            handler(e)
-
-    def _dfu_progress(self, ctx, p):
-        if self._progress_handler != None:
-            self._progress_handler(p)
+    def update_firmware(self, **kwargs):
+        """
+        Synchronous variant of `update_firmware_async`
+        """
+        from .dfu import FirmwareUpdate
+        FirmwareUpdate(self, **kwargs).run()
@@ -0,0 +1,152 @@
+from bisect import bisect_left
+
+import threading
+import time
+
+class LatencyHistogram(object):
+    """Histogram of durations, in seconds, with power of 2 bucket bounds from 1us to ~1s"""
+
+    BOUNDS = [1e-6 * (1 << i) for i in range(21)]
+
+    def __init__(self):
+        self.counts = [0] * (len(LatencyHistogram.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LatencyHistogram.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, None if nothing was observed"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(LatencyHistogram.BOUNDS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": list(zip(LatencyHistogram.BOUNDS + [float('inf')], self.counts))
+        }
+
+class Metrics(object):
+    """
+    Counters and latency histograms for a MetaWear object's hot paths.  Updates are plain attribute increments made on 
+    the transport threads; a snapshot may therefore be off by the updates in flight while it is taken
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.notifications = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.writes = 0
+        self.max_write_queue_depth = 0
+        self.write_queue_time = LatencyHistogram()
+        self.callback_time = LatencyHistogram()
+
+        self._lock = threading.Lock()
+        self._last = (self.start, 0)
+
+    def notified(self, length, elapsed):
+        self.notifications += 1
+        self.bytes_in += length
+        self.callback_time.observe(elapsed)
+
+    def queued(self, length, depth):
+        self.writes += 1
+        self.bytes_out += length
+        if depth > self.max_write_queue_depth:
+            self.max_write_queue_depth = depth
+
+    def snapshot(self, **kwargs):
+        """
+        Returns the current values as a dict.  notifications_per_sec covers the time since the previous snapshot
+        @params:
+            gauges      - Optional  : Dict of additional point in time values to include
+        """
+        now = time.time()
+        with self._lock:
+            last_time, last_notifications = self._last
+            self._last = (now, self.notifications)
+
+        values = {
+            "uptime": now - self.start,
+            "notifications": self.notifications,
+            "notifications_per_sec": (self.notifications - last_notifications) / (now - last_time) if now > last_time else 0.0,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "writes": self.writes,
+            "max_write_queue_depth": self.max_write_queue_depth,
+            "write_queue_time": self.write_queue_time.snapshot(),
+            "callback_time": self.callback_time.snapshot()
+        }
+        if 'gauges' in kwargs:
+            values.update(kwargs['gauges'])
+        return values
+
+# snapshot values exported as gauges rather than counters; per the Prometheus naming conventions, counters get a '_total' 
+# suffix and durations a '_seconds' one
+_INT_GAUGES = ('write_queue_depth', 'max_write_queue_depth')
+_SECONDS_GAUGES = ('uptime',)
+
+def to_prometheus(snapshot, **kwargs):
+    """
+    Formats a metrics snapshot in the Prometheus text exposition format.  Integer values other than the write queue depths 
+    are exported as counters named with a '_total' suffix, e.g. metawear_bytes_in_total, and uptime as metawear_uptime_seconds
+    @params:
+        snapshot    - Required  : Dict returned by MetaWear.metrics_snapshot
+        labels      - Optional  : Dict of labels added to every sample, e.g. {'address': d.address}
+        prefix      - Optional  : Metric name prefix, defaults to 'metawear_'
+    """
+    prefix = kwargs['prefix'] if 'prefix' in kwargs else 'metawear_'
+    labels = kwargs['labels'] if 'labels' in kwargs else {}
+
+    def format_labels(extra = {}):
+        merged = dict(labels)
+        merged.update(extra)
+        if len(merged) == 0:
+            return ''
+        return '{' + ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in sorted(merged.items())) + '}'
+
+    lines = []
+    for name, value in sorted(snapshot.items()):
+        if isinstance(value, dict) and 'buckets' in value:
+            metric = prefix + name + '_seconds'
+            lines.append('# TYPE %s histogram' % (metric))
+            cumulative = 0
+            for bound, count in value['buckets']:
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (metric, format_labels({'le': '+Inf' if bound == float('inf') else repr(bound)}), cumulative))
+            lines.append('%s_sum%s %r' % (metric, format_labels(), value['sum']))
+            lines.append('%s_count%s %d' % (metric, format_labels(), value['count']))
+        elif isinstance(value, dict):
+            metric = prefix + name + '_seconds'
+            lines.append('# TYPE %s gauge' % (metric))
+            for phase, seconds in sorted(value.items()):
+                lines.append('%s%s %r' % (metric, format_labels({'phase': phase}), seconds))
+        elif isinstance(value, (int, float)):
+            if name in _SECONDS_GAUGES:
+                metric, kind = prefix + name + '_seconds', 'gauge'
+            elif isinstance(value, int) and name not in _INT_GAUGES:
+                metric, kind = prefix + name + '_total', 'counter'
+            else:
+                metric, kind = prefix + name, 'gauge'
+            lines.append('# TYPE %s %s' % (metric, kind))
+            lines.append('%s%s %r' % (metric, format_labels(), value))
+    return '\n'.join(lines) + '\n'
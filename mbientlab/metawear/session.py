@@ -0,0 +1,104 @@
+from .metawear import MetaWear, MetaWearUSB
+from threading import Event
+from types import SimpleNamespace
+
+import time
+
+class MetaWearSession(object):
+    """Connects, initializes, and configures several MetaWear boards concurrently"""
+
+    def __init__(self, addresses, **kwargs):
+        """
+        Creates a MetaWearSession object
+        @params:
+            addresses       - Required  : List of mac addresses of the boards to connect to
+            max_parallel    - Optional  : Max number of boards being set up at the same time, defaults to 4
+            retries         - Optional  : Number of times a failed connection attempt is retried, defaults to 2
+            timeout         - Optional  : Seconds to wait for a connection attempt to complete, defaults to 30.0
+            device_args     - Optional  : Dict of keyword arguments passed to each MetaWear object
+        """
+        self.addresses = [a.upper() for a in addresses]
+        self.max_parallel = kwargs['max_parallel'] if ('max_parallel' in kwargs) else 4
+        self.retries = kwargs['retries'] if ('retries' in kwargs) else 2
+        self.timeout = kwargs['timeout'] if ('timeout' in kwargs) else 30.0
+        self.device_args = kwargs['device_args'] if ('device_args' in kwargs) else {}
+
+        self.results = []
+
+    @property
+    def devices(self):
+        """
+        MetaWear objects of the boards that were successfully set up
+        """
+        return [r.device for r in self.results if r.error is None]
+
+    def _connect(self, device):
+        e = Event()
+        result = []
+
+        def completed(error):
+            result.append(error)
+            e.set()
+
+        device.connect_async(completed)
+        if not e.wait(self.timeout):
+            device.disconnect()
+            return RuntimeError("Timed out connecting to %s" % (device.address))
+        return result[0]
+
+    def _setup(self, address, configure):
+        result = SimpleNamespace(address = address, device = None, error = None, attempts = 0, timings = {})
+        start = time.time()
+
+        try:
+            result.device = MetaWear(address, **self.device_args)
+
+            while True:
+                result.attempts += 1
+                phase = time.time()
+                result.error = self._connect(result.device)
+                result.timings['connect'] = time.time() - phase
+                result.timings.update(result.device.connection_timings)
+                if result.error is None or result.attempts > self.retries:
+                    break
+
+            if result.error is None and configure is not None:
+                phase = time.time()
+                try:
+                    configure(result.device)
+                except Exception:
+                    # failed boards are left out of devices, so disconnect() would never reach this one
+                    result.device.disconnect()
+                    raise
+                result.timings['configure'] = time.time() - phase
+        except Exception as err:
+            result.error = err
+
+        result.timings['total'] = time.time() - start
+        return result
+
+    def connect(self, **kwargs):
+        """
+        Sets up all boards and returns one result per address, in the order the addresses were given.  Each result has 
+        the address, device, error (None on success), number of connection attempts, and a timings dict with the seconds spent 
+        in the 'connect' (link and SDK initialization), 'link', 'initialize', 'configure', and 'total' phases
+        @params:
+            configure   - Optional  : `(MetaWear) -> void` function called on each board once connected
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        configure = kwargs['configure'] if ('configure' in kwargs) else None
+        if 'transport' not in self.device_args:
+            # one USB scan for every board instead of one per board
+            MetaWearUSB.resolve(self.addresses)
+        with ThreadPoolExecutor(max_workers = self.max_parallel) as executor:
+            futures = [executor.submit(self._setup, a, configure) for a in self.addresses]
+            self.results = [f.result() for f in futures]
+        return self.results
+
+    def disconnect(self):
+        """
+        Disconnects from all boards
+        """
+        for d in self.devices:
+            d.disconnect()
@@ -0,0 +1,321 @@
+from types import SimpleNamespace
+
+import os
+import struct
+import sys
+import threading
+import time
+
+if sys.version_info < (3, 8):
+    raise ImportError("mbientlab.metawear.shard requires Python 3.8 or newer for multiprocessing.shared_memory")
+
+class SampleRing(object):
+    """
+    Single consumer ring buffer of fixed size sample records in shared memory.  Each record holds a board index, signal
+    index, epoch, and up to MAX_VALUES numeric values, so samples cross the process boundary without being pickled.  The
+    producer drops, and counts, samples when the ring is full rather than waiting on the consumer.  The read and write 
+    indices are only accessed while holding a lock shared by both processes, whose semaphore orders the record stores 
+    before the index that publishes them, also on weakly ordered cpus such as ARM
+    """
+
+    MAX_VALUES = 4
+
+    _HEADER = struct.Struct('<4Q')
+    _RECORD = struct.Struct('<HHBxxxq%dd' % (MAX_VALUES))
+    _WRITE, _READ, _DROPPED, _UNSUPPORTED = range(4)
+
+    def __init__(self, **kwargs):
+        """
+        Creates a new ring or attaches to an existing one
+        @params:
+            name        - Optional  : Name of the shared memory block to attach to, creates a new block if not set
+            capacity    - Optional  : Number of records the ring holds when creating a new block, defaults to 65536
+            lock        - Optional  : multiprocessing Lock guarding the indices, required when attaching to an existing block.  
+                                      Defaults to a new multiprocessing.Lock when creating one
+        """
+        import multiprocessing
+        from multiprocessing import shared_memory
+
+        if 'name' in kwargs:
+            if 'lock' not in kwargs:
+                raise ValueError("Missing the lock shared with the process that created the ring")
+            self.lock = kwargs['lock']
+            self.shm = shared_memory.SharedMemory(name = kwargs['name'])
+            self.capacity = (self.shm.size - SampleRing._HEADER.size) // SampleRing._RECORD.size
+            self.owner = False
+        else:
+            self.capacity = kwargs['capacity'] if ('capacity' in kwargs) else 65536
+            self.lock = kwargs['lock'] if ('lock' in kwargs) else multiprocessing.Lock()
+            self.shm = shared_memory.SharedMemory(create = True, size = SampleRing._HEADER.size + self.capacity * SampleRing._RECORD.size)
+            SampleRing._HEADER.pack_into(self.shm.buf, 0, 0, 0, 0, 0)
+            self.owner = True
+        self.name = self.shm.name
+
+    def _get(self, field):
+        return struct.unpack_from('<Q', self.shm.buf, field * 8)[0]
+
+    def _set(self, field, value):
+        struct.pack_into('<Q', self.shm.buf, field * 8, value)
+
+    @property
+    def dropped(self):
+        """Number of samples dropped because the ring was full"""
+        return self._get(SampleRing._DROPPED)
+
+    @property
+    def unsupported(self):
+        """Number of samples dropped because their value was not a number or a tuple of at most MAX_VALUES numbers"""
+        return self._get(SampleRing._UNSUPPORTED)
+
+    def put(self, board, signal, epoch, value):
+        """
+        Appends a sample, returns false if it was dropped.  Only one thread may call put at a time
+        @params:
+            board       - Required  : Index of the board the sample came from
+            signal      - Required  : Index of the signal on that board
+            epoch       - Required  : Sample's epoch, in milliseconds
+            value       - Required  : Value returned by parse_value(as_tuple = True)
+        """
+        if isinstance(value, (int, float)):
+            value = (value,)
+        elif not isinstance(value, (tuple, list)) or len(value) > SampleRing.MAX_VALUES or \
+                not all(isinstance(v, (int, float)) for v in value):
+            self._set(SampleRing._UNSUPPORTED, self.unsupported + 1)
+            return False
+
+        with self.lock:
+            write = self._get(SampleRing._WRITE)
+            read = self._get(SampleRing._READ)
+        if write - read >= self.capacity:
+            self._set(SampleRing._DROPPED, self.dropped + 1)
+            return False
+
+        values = tuple(value) + (0.0,) * (SampleRing.MAX_VALUES - len(value))
+        offset = SampleRing._HEADER.size + (write % self.capacity) * SampleRing._RECORD.size
+        SampleRing._RECORD.pack_into(self.shm.buf, offset, board, signal, len(value), epoch, *values)
+        # publish the record only once it is fully written
+        with self.lock:
+            self._set(SampleRing._WRITE, write + 1)
+        return True
+
+    def drain(self, **kwargs):
+        """
+        Removes and returns the buffered samples as a list of (board, signal, epoch, values) tuples
+        @params:
+            limit       - Optional  : Max number of samples to remove, defaults to all of them
+        """
+        with self.lock:
+            read = self._get(SampleRing._READ)
+            end = self._get(SampleRing._WRITE)
+        if 'limit' in kwargs:
+            end = min(end, read + kwargs['limit'])
+
+        samples = []
+        for i in range(read, end):
+            record = SampleRing._RECORD.unpack_from(self.shm.buf, SampleRing._HEADER.size + (i % self.capacity) * SampleRing._RECORD.size)
+            samples.append((record[0], record[1], record[3], record[4:4 + record[2]]))
+        # release the slots only once they are read
+        with self.lock:
+            self._set(SampleRing._READ, end)
+        return samples
+
+    def close(self):
+        """Detaches from the shared memory, and frees it if this object created the block"""
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def _run_shard(addresses, ring_name, ring_lock, configure, start_sampling, device_args, stop, status):
+    """Worker process entry point: connects to its boards, streams their signals into the ring, and waits for the stop event"""
+    from . import libmetawear, parse_value
+    from .cbindings import FnVoid_VoidP_DataP
+    from .session import MetaWearSession
+
+    ring = SampleRing(name = ring_name, lock = ring_lock)
+    lock = threading.Lock()
+    signals = {}
+    callbacks = []
+
+    def subscribe(device):
+        board = addresses.index(device.address)
+        signals[board] = list(configure(device))
+        for i, (name, signal) in enumerate(signals[board]):
+            def data_handler(ctx, pointer, board = board, i = i):
+                value = parse_value(pointer, as_tuple = True)
+                with lock:
+                    ring.put(board, i, pointer.contents.epoch, value)
+            callbacks.append(FnVoid_VoidP_DataP(data_handler))
+            libmetawear.mbl_mw_datasignal_subscribe(signal, None, callbacks[-1])
+        if start_sampling is not None:
+            start_sampling(device)
+
+    session = MetaWearSession(addresses, device_args = device_args)
+    try:
+        results = session.connect(configure = subscribe)
+        status.put([(r.address, None if r.error is None else repr(r.error), [n for n, s in signals.get(i, [])])
+                for i, r in enumerate(results)])
+        stop.wait()
+    finally:
+        for board in signals:
+            for name, signal in signals[board]:
+                libmetawear.mbl_mw_datasignal_unsubscribe(signal)
+        session.disconnect()
+        ring.close()
+
+class ShardedSession(object):
+    """
+    Streams data from many boards using several worker processes, so the callbacks of different boards are not
+    serialized by one interpreter lock.  Each worker connects to its share of the boards, with its own libmetawear
+    instance and, optionally, its own hci adapter, and writes the decoded samples into a shared memory SampleRing that a
+    thread in this process drains into the handler
+    """
+
+    def __init__(self, addresses, configure, **kwargs):
+        """
+        Creates a ShardedSession object
+        @params:
+            addresses   - Required  : List of mac addresses of the boards to stream from
+            configure   - Required  : `(MetaWear) -> list` function run in the worker process once a board is connected,
+                                      returns the (name, signal) pairs to stream.  Must be a module level function so it can
+                                      be sent to the worker
+            start_sampling          - Optional  : `(MetaWear) -> void` module level function run in the worker process once the
+                                                  signals are subscribed to, e.g. to start the sensors, so no samples are missed
+            processes   - Optional  : Number of worker processes, defaults to one per hci adapter or else one per cpu core
+            hci_macs    - Optional  : List of mac addresses of the hci adapters to use, one per worker process
+            capacity    - Optional  : Number of samples each worker's ring holds, defaults to 65536
+            poll_interval           - Optional  : Seconds the drain thread sleeps when every ring is empty, defaults to 0.005
+            device_args - Optional  : Dict of keyword arguments passed to each MetaWear object
+        """
+        self.addresses = [a.upper() for a in addresses]
+        self.configure = configure
+        self.start_sampling = kwargs['start_sampling'] if ('start_sampling' in kwargs) else None
+        self.hci_macs = kwargs['hci_macs'] if ('hci_macs' in kwargs) else None
+        if 'processes' in kwargs:
+            self.processes = kwargs['processes']
+        else:
+            self.processes = len(self.hci_macs) if self.hci_macs is not None else (os.cpu_count() or 1)
+        self.processes = max(1, min(self.processes, len(self.addresses)))
+        self.capacity = kwargs['capacity'] if ('capacity' in kwargs) else 65536
+        self.poll_interval = kwargs['poll_interval'] if ('poll_interval' in kwargs) else 0.005
+        self.device_args = kwargs['device_args'] if ('device_args' in kwargs) else {}
+
+        self.results = []
+        self.received = 0
+        self._dropped = 0
+        self._shards = []
+        self._drainer = None
+        self._stopped = threading.Event()
+
+    @property
+    def dropped(self):
+        """
+        Number of samples dropped because a ring was full, the value could not be stored, or the board's signals are unknown
+        """
+        return self._dropped + sum(s.ring.dropped + s.ring.unsupported for s in self._shards)
+
+    def start(self, handler, **kwargs):
+        """
+        Starts the workers, waits for them to connect, and returns one result per address, in the order given, with the
+        address, worker index, error (None on success), and names of the streamed signals
+        @params:
+            handler     - Required  : `(str, str, int, tuple) -> void` function called on the drain thread with each sample's
+                                      board address, signal name, epoch, and values
+            timeout     - Optional  : Seconds to wait for the workers to connect to their boards, defaults to how long the 
+                                      largest worker's MetaWearSession can take when every attempt times out.  Workers that 
+                                      have not reported back by then are terminated
+        """
+        import math
+        import multiprocessing
+        from .session import MetaWearSession
+
+        if len(self._shards):
+            raise RuntimeError("ShardedSession is already running, call stop() before starting it again")
+
+        if 'timeout' in kwargs:
+            timeout = kwargs['timeout']
+        else:
+            # same settings as the session each worker runs, plus time to start the worker's interpreter
+            session = MetaWearSession(self.addresses[0::self.processes], device_args = self.device_args)
+            timeout = session.timeout * (session.retries + 1) * math.ceil(len(session.addresses) / session.max_parallel) + 30.0
+        # a fresh interpreter per worker, libmetawear and its threads do not survive a fork
+        context = multiprocessing.get_context('spawn')
+        stop = context.Event()
+        self._stopped.clear()
+
+        for i in range(self.processes):
+            shard = SimpleNamespace(addresses = self.addresses[i::self.processes], ring = SampleRing(capacity = self.capacity, 
+                    lock = context.Lock()), status = context.Queue(), signals = [])
+            device_args = dict(self.device_args)
+            if self.hci_macs is not None:
+                device_args['hci_mac'] = self.hci_macs[i % len(self.hci_macs)]
+            shard.process = context.Process(target = _run_shard, args = (shard.addresses, shard.ring.name, shard.ring.lock, self.configure,
+                    self.start_sampling, device_args, stop, shard.status), daemon = True)
+            shard.process.start()
+            self._shards.append(shard)
+        self._stop = stop
+
+        results = {}
+        deadline = time.time() + timeout
+        for i, shard in enumerate(self._shards):
+            try:
+                status = shard.status.get(timeout = max(0.0, deadline - time.time()))
+            except Exception:
+                # its boards have no registered signals, do not let it keep streaming into the ring
+                shard.process.terminate()
+                shard.process.join()
+                status = [(a, "Timed out waiting for worker %d" % (i), []) for a in shard.addresses]
+            for address, error, names in status:
+                shard.signals.append(names)
+                results[address] = SimpleNamespace(address = address, worker = i, error = error, signals = names)
+        self.results = [results[a] for a in self.addresses]
+
+        self._drainer = threading.Thread(target = self._drain, args = (handler,), daemon = True)
+        self._drainer.start()
+        return self.results
+
+    def _drain_once(self, handler):
+        count = 0
+        for shard in self._shards:
+            for board, signal, epoch, values in shard.ring.drain():
+                if board >= len(shard.signals) or signal >= len(shard.signals[board]):
+                    # sample from a board whose signals were never reported, e.g. its worker timed out
+                    self._dropped += 1
+                    continue
+                try:
+                    handler(shard.addresses[board], shard.signals[board][signal], epoch, values)
+                except Exception as err:
+                    print(str(err))
+                count += 1
+        self.received += count
+        return count
+
+    def _drain(self, handler):
+        while not self._stopped.is_set():
+            if self._drain_once(handler) == 0:
+                time.sleep(self.poll_interval)
+        self._drain_once(handler)
+
+    def stop(self, **kwargs):
+        """
+        Stops the workers, which disconnect from their boards, and delivers the remaining samples
+        @params:
+            timeout     - Optional  : Seconds to wait for each worker to exit before terminating it, defaults to 10.0
+        """
+        timeout = kwargs['timeout'] if ('timeout' in kwargs) else 10.0
+        if len(self._shards) == 0:
+            return
+
+        self._stop.set()
+        for shard in self._shards:
+            shard.process.join(timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+                shard.process.join()
+
+        self._stopped.set()
+        if self._drainer is not None:
+            self._drainer.join()
+        self._dropped = self.dropped
+        for shard in self._shards:
+            shard.ring.close()
+        self._shards = []
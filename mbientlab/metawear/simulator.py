@@ -0,0 +1,487 @@
+from .cbindings import *
+from .metawear import MetaWear, MetaWearUSB
+from collections import deque
+from threading import Condition
+from types import SimpleNamespace
+
+import heapq
+import math
+import struct
+import threading
+import time
+
+class VirtualConnection(object):
+    """
+    Base class for software transports that stand in for the BLE and USB connections.  Commands written to the command 
+    characteristic are passed to `_received`, and notifications queued with `schedule` are delivered in order from a 
+    dedicated thread, never from inside a write
+    """
+
+    def __init__(self, address, info):
+        self.address = address.upper()
+        self.info = info
+
+        self._notify_handler = None
+        self._disconnect_handler = None
+        self._connected = False
+        self._cond = Condition()
+        self._pending = []
+        self._sequence = 0
+        self._thread = None
+
+    @property
+    def is_enumerated(self):
+        return True
+
+    @property
+    def is_connected(self):
+        return self._connected
+
+    def connect_async(self, handler):
+        with self._cond:
+            self._connected = True
+            self._pending = []
+        self._thread = threading.Thread(target=self._deliver, daemon=True)
+        self._thread.start()
+        self._on_connect()
+        handler(None)
+
+    def disconnect(self):
+        if self._connected:
+            with self._cond:
+                self._connected = False
+                self._cond.notify_all()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._on_disconnect()
+
+        if self._disconnect_handler is not None:
+            self._disconnect_handler(Const.STATUS_OK)
+
+    def schedule(self, value, delay = 0.0):
+        """
+        Queues a notification, or a `() -> bytes` function producing it, for delivery after the delay in seconds
+        """
+        with self._cond:
+            self._sequence += 1
+            heapq.heappush(self._pending, (time.time() + delay, self._sequence, value))
+            self._cond.notify_all()
+
+    def _deliver(self):
+        while True:
+            with self._cond:
+                while self._connected and (len(self._pending) == 0 or self._pending[0][0] > time.time()):
+                    self._cond.wait(None if len(self._pending) == 0 else self._pending[0][0] - time.time())
+                if not self._connected:
+                    return
+                due, sequence, value = heapq.heappop(self._pending)
+
+            if callable(value):
+                value = value()
+            if value is not None and self._notify_handler is not None:
+                self._notify_handler(value)
+
+    def _on_connect(self):
+        pass
+
+    def _on_disconnect(self):
+        pass
+
+    def _received(self, value):
+        pass
+
+    def _write(self, value, handler):
+        self._received(bytes(value))
+        handler(None)
+
+    def service_exists(self, uuid):
+        return uuid.lower() == MetaWear.GATT_SERVICE or uuid.lower() == MetaWearUSB.GATT_DIS.lower()
+
+    def find_characteristic(self, uuid):
+        if uuid.lower() == MetaWear.GATT_SERVICE or uuid.lower() == MetaWearUSB.GATT_MW_CHAR_COMMAND:
+            return SimpleNamespace(write_async = self._write, write_without_resp_async = self._write)
+        if uuid.lower() == MetaWearUSB.GATT_MW_CHAR_NOTIFICATION:
+            return SimpleNamespace(enable_notifications_async = lambda x: x(None),
+                                   on_notification_received = self.on_notification_received)
+        if uuid.lower() in MetaWear._DEV_INFO.keys():
+            return SimpleNamespace(read_value_async = lambda x: x(self.info[MetaWear._DEV_INFO[uuid.lower()]].encode(), None))
+        return None
+
+    def on_notification_received(self, handler):
+        self._notify_handler = handler
+
+    def on_disconnect(self, handler):
+        self._disconnect_handler = handler
+
+def _acc_sample(n, rate):
+    # BMI270 at +/-4g, 8192 LSB/g
+    t = 2.0 * math.pi * n / rate
+    return struct.pack('<3h', int(4096 * math.sin(t)), int(4096 * math.cos(t)), 8192)
+
+def _gyro_sample(n, rate):
+    # 16.4 LSB/dps at 2000dps
+    t = 2.0 * math.pi * n / rate
+    return struct.pack('<3h', int(1640 * math.sin(t)), int(1640 * math.cos(t)), 0)
+
+def _mag_sample(n, rate):
+    # BMM150, 16 LSB/uT
+    t = 2.0 * math.pi * n / rate
+    return struct.pack('<3h', int(480 * math.cos(t)), int(480 * math.sin(t)), -640)
+
+def _quaternion_sample(n, rate):
+    half = math.pi * n / rate
+    return struct.pack('<4f', math.cos(half), 0.0, 0.0, math.sin(half))
+
+class MetaWearSimulator(VirtualConnection):
+    """
+    Software model of a MetaMotionS board for exercising the SDK without hardware.  It answers module discovery, 
+    logging time and length reads, hands out ids when loggers, processors, events, timers, and macros are created, 
+    streams acc / gyro / mag / sensor fusion data when the matching module is started, and replays queued log entries 
+    when a log download is requested.  The debug disconnect, reset, and jump to bootloader commands drop the connection, 
+    the latter into a MetaBoot mode that accepts firmware updates over the legacy Nordic DFU service.  Commands it does 
+    not model are accepted and recorded in `unhandled`.
+
+    The protocol model is deliberately approximate: it is meant for load testing the host side, not for validating 
+    firmware behaviour.
+    """
+
+    # module id: (implementation, revision, extra)
+    MODULES = {
+        0x01: (0, 0, b''),
+        0x02: (0, 1, b''),
+        0x03: (4, 0, b''),
+        0x04: (1, 0, b'\x00\x03\x01\x02'),
+        0x05: (0, 2, b'\x03\x03\x03\x03\x01\x01\x01\x01'),
+        0x07: (0, 0, b''),
+        0x08: (0, 0, b''),
+        0x09: (0, 3, b'\x1c'),
+        0x0a: (0, 0, b'\x1c'),
+        0x0b: (0, 2, b'\x08\x80\x2b\x00\x00'),
+        0x0c: (0, 0, b'\x08'),
+        0x0d: (0, 1, b''),
+        0x0f: (0, 1, b'\x08'),
+        0x11: (0, 9, b'\x03'),
+        0x12: (0, 0, b''),
+        0x13: (1, 0, b''),
+        0x14: (0, 0, b''),
+        0x15: (0, 2, b''),
+        0x19: (0, 3, b'\x03\x00\x06\x00\x02\x00\x01\x00'),
+        0xfe: (0, 3, b'')
+    }
+
+    # stream name: (module id, data register, sample generator)
+    STREAMS = {
+        'acc': (0x03, 0x04, _acc_sample),
+        'gyro': (0x13, 0x05, _gyro_sample),
+        'mag': (0x15, 0x05, _mag_sample),
+        'fusion': (0x19, 0x07, _quaternion_sample)
+    }
+
+    # modules whose register 0x02 creates an object and responds with its id
+    _CREATE_MODULES = (0x09, 0x0a, 0x0b, 0x0c, 0x0f)
+
+    LOGGING = 0x0b
+    SETTINGS = 0x11
+    CONNECTION_PARAMS = 0x09
+    DEBUG = 0xfe
+    # debug registers that end the connection
+    DEBUG_RESET = 0x01
+    DEBUG_BOOTLOADER = 0x02
+    DEBUG_RESET_AFTER_GC = 0x05
+    DEBUG_DISCONNECT = 0x06
+
+    DFU_SERVICE = "00001530-1212-efde-1523-785feabcd123"
+    DFU_CONTROL_POINT = "00001531-1212-efde-1523-785feabcd123"
+    DFU_PACKET = "00001532-1212-efde-1523-785feabcd123"
+    DFU_VERSION = "00001534-1212-efde-1523-785feabcd123"
+    # control point op codes
+    DFU_START = 0x01
+    DFU_INIT_PARAMS = 0x02
+    DFU_RECEIVE_IMAGE = 0x03
+    DFU_VALIDATE = 0x04
+    DFU_ACTIVATE_AND_RESET = 0x05
+    DFU_RESET = 0x06
+    DFU_IMAGE_SIZE = 0x07
+    DFU_PACKET_RECEIPT_REQUEST = 0x08
+    DFU_RESPONSE = 0x10
+    DFU_PACKET_RECEIPT = 0x11
+    TICK_PERIOD = 48.0 / 32768.0
+
+    def __init__(self, address = "F0:00:00:00:00:00", **kwargs):
+        """
+        Creates a MetaWearSimulator object
+        @params:
+            address     - Optional  : Mac address the simulated board reports
+            info        - Optional  : Device information dict, defaults to a MetaMotionS running firmware 1.7.3
+            modules     - Optional  : Dict of module id to (implementation, revision, extra bytes), defaults to MODULES
+            rates       - Optional  : Dict of stream name to sample rate in Hz, None streams as fast as possible.  Defaults to 
+                                      100Hz acc, gyro, and fusion and 25Hz mag
+            log_rate    - Optional  : Log entries replayed per second during a download, None replays as fast as possible.  Defaults to None
+            connection_update_delay - Optional  : Seconds between a connection parameters command and the simulated 
+                                                  parameter update event, defaults to 0.05
+            metaboot    - Optional  : Start in MetaBoot mode, defaults to false
+            dfu_version - Optional  : Firmware version the board reports after a firmware update, defaults to keeping the current one
+        """
+        info = {'manufacturer': 'MbientLab Inc', 'model': '8', 'hardware': '0.1', 'firmware': '1.7.3', 'serial': '000000'}
+        if 'info' in kwargs:
+            info.update(kwargs['info'])
+        VirtualConnection.__init__(self, address, info)
+
+        self.modules = kwargs['modules'] if 'modules' in kwargs else dict(MetaWearSimulator.MODULES)
+        self.rates = {'acc': 100.0, 'gyro': 100.0, 'mag': 25.0, 'fusion': 100.0}
+        if 'rates' in kwargs:
+            self.rates.update(kwargs['rates'])
+        self.log_rate = kwargs['log_rate'] if 'log_rate' in kwargs else None
+        self.connection_update_delay = kwargs['connection_update_delay'] if 'connection_update_delay' in kwargs else 0.05
+        self.connection_parameters = None
+        self._connection_handler = None
+        self.metaboot = kwargs['metaboot'] if 'metaboot' in kwargs else False
+        self.dfu_version = kwargs['dfu_version'] if 'dfu_version' in kwargs else None
+        self.firmware_updates = 0
+        self._dfu = None
+        self._dfu_handler = None
+        self._dfu_receipt_every = 0
+
+        self.commands = 0
+        self.unhandled = []
+        self.reset_uid = 0
+        self.log = deque()
+
+        self._streams = {}
+        self._next_ids = {}
+        self._start = time.time()
+
+    def _on_connect(self):
+        self._streams = {}
+
+    def _respond(self, *values):
+        for v in values:
+            self.schedule(bytes(v))
+
+    def _tick(self):
+        return int((time.time() - self._start) / MetaWearSimulator.TICK_PERIOD)
+
+    def _received(self, cmd):
+        self.commands += 1
+        module = cmd[0]
+        register = cmd[1] if len(cmd) > 1 else None
+
+        if register == 0x80:
+            if module in self.modules:
+                implementation, revision, extra = self.modules[module]
+                self._respond(bytes([module, 0x80, implementation, revision]) + extra)
+            else:
+                self._respond(bytes([module, 0x80]))
+        elif module in MetaWearSimulator._CREATE_MODULES and register == 0x02 and module in self.modules:
+            next_id = self._next_ids.get(module, 0)
+            self._next_ids[module] = next_id + 1
+            self._respond(bytes([module, 0x02, next_id]))
+        elif module == MetaWearSimulator.LOGGING and register == 0x84:
+            self._respond(bytes([module, 0x84]) + struct.pack('<IB', self._tick(), self.reset_uid))
+        elif module == MetaWearSimulator.LOGGING and register == 0x85:
+            self._respond(bytes([module, 0x85]) + struct.pack('<I', len(self.log)))
+        elif module == MetaWearSimulator.LOGGING and register == 0x06 and len(cmd) >= 10:
+            self._readout(*struct.unpack_from('<II', cmd, 2))
+        elif module == MetaWearSimulator.SETTINGS and register == MetaWearSimulator.CONNECTION_PARAMS and len(cmd) >= 10:
+            self._update_connection(*struct.unpack_from('<4H', cmd, 2))
+        elif module == MetaWearSimulator.DEBUG and register in (MetaWearSimulator.DEBUG_RESET, MetaWearSimulator.DEBUG_RESET_AFTER_GC):
+            self.reset_uid = (self.reset_uid + 1) & 0x7
+            self._drop_connection()
+        elif module == MetaWearSimulator.DEBUG and register == MetaWearSimulator.DEBUG_BOOTLOADER:
+            self.metaboot = True
+            self._drop_connection()
+        elif module == MetaWearSimulator.DEBUG and register == MetaWearSimulator.DEBUG_DISCONNECT:
+            self._drop_connection()
+        elif register == 0x01 and len(cmd) > 2 and self._stream_name(module) is not None:
+            if cmd[2] == 1:
+                self.start_stream(self._stream_name(module))
+            else:
+                self.stop_stream(self._stream_name(module))
+        else:
+            self.unhandled.append(cmd)
+
+    def _drop_connection(self):
+        # the board ends the link after acknowledging the write, not from inside it
+        threading.Thread(target=self.disconnect, daemon=True).start()
+
+    def service_exists(self, uuid):
+        if self.metaboot:
+            return uuid.lower() == MetaWearSimulator.DFU_SERVICE or uuid.lower() == MetaWearUSB.GATT_DIS.lower()
+        return VirtualConnection.service_exists(self, uuid)
+
+    def find_characteristic(self, uuid):
+        if not self.metaboot:
+            return VirtualConnection.find_characteristic(self, uuid)
+
+        if uuid.lower() == MetaWearSimulator.DFU_CONTROL_POINT:
+            def write(value, handler):
+                self._dfu_command(bytes(value))
+                handler(None)
+            return SimpleNamespace(uuid = uuid, write_async = write, write_without_resp_async = write,
+                    enable_notifications_async = lambda x: x(None), on_notification_received = self._on_dfu_notification)
+        if uuid.lower() == MetaWearSimulator.DFU_PACKET:
+            def write(value, handler):
+                self._dfu_packet(bytes(value))
+                handler(None)
+            return SimpleNamespace(uuid = uuid, write_async = write, write_without_resp_async = write)
+        if uuid.lower() == MetaWearSimulator.DFU_VERSION:
+            return SimpleNamespace(uuid = uuid, read_value_async = lambda x: x(b'\x08\x00', None))
+        if uuid.lower() in MetaWear._DEV_INFO.keys():
+            return VirtualConnection.find_characteristic(self, uuid)
+        return None
+
+    def _on_dfu_notification(self, handler):
+        self._dfu_handler = handler
+
+    def _dfu_notify(self, *values):
+        def notify():
+            if self._dfu_handler is not None:
+                self._dfu_handler(bytes(values))
+        self.schedule(notify)
+
+    def _dfu_command(self, cmd):
+        op = cmd[0]
+        if op == MetaWearSimulator.DFU_START:
+            self._dfu = SimpleNamespace(state = 'size', image_size = 0, received = 0, packets = 0, valid = False)
+        elif op == MetaWearSimulator.DFU_PACKET_RECEIPT_REQUEST:
+            self._dfu_receipt_every = struct.unpack_from('<H', cmd, 1)[0] if len(cmd) >= 3 else 0
+        elif self._dfu is None:
+            self.unhandled.append(cmd)
+        elif op == MetaWearSimulator.DFU_INIT_PARAMS:
+            if len(cmd) > 1 and cmd[1] == 0x01:
+                self._dfu.state = None
+                self._dfu_notify(MetaWearSimulator.DFU_RESPONSE, op, 0x01)
+            else:
+                self._dfu.state = 'init'
+        elif op == MetaWearSimulator.DFU_RECEIVE_IMAGE:
+            self._dfu.state = 'image'
+        elif op == MetaWearSimulator.DFU_VALIDATE:
+            self._dfu.valid = self._dfu.image_size > 0 and self._dfu.received == self._dfu.image_size
+            self._dfu_notify(MetaWearSimulator.DFU_RESPONSE, op, 0x01 if self._dfu.valid else 0x05)
+        elif op == MetaWearSimulator.DFU_IMAGE_SIZE:
+            self._dfu_notify(*(bytes([MetaWearSimulator.DFU_RESPONSE, op, 0x01]) + struct.pack('<I', self._dfu.received)))
+        elif op == MetaWearSimulator.DFU_ACTIVATE_AND_RESET and self._dfu.valid:
+            self.firmware_updates += 1
+            if self.dfu_version is not None:
+                self.info['firmware'] = self.dfu_version
+            self.metaboot = False
+            self._dfu = None
+            self._drop_connection()
+        elif op == MetaWearSimulator.DFU_RESET or op == MetaWearSimulator.DFU_ACTIVATE_AND_RESET:
+            # an invalid image leaves the board in MetaBoot mode
+            self._dfu = None
+            self._drop_connection()
+        else:
+            self.unhandled.append(cmd)
+
+    def _dfu_packet(self, value):
+        if self._dfu is None:
+            return
+        if self._dfu.state == 'size':
+            # soft device, bootloader, and application sizes
+            self._dfu.image_size = sum(struct.unpack_from('<3I', value)) if len(value) >= 12 else struct.unpack_from('<I', value)[0]
+            self._dfu.state = None
+            self._dfu_notify(MetaWearSimulator.DFU_RESPONSE, MetaWearSimulator.DFU_START, 0x01)
+        elif self._dfu.state == 'image':
+            self._dfu.received += len(value)
+            self._dfu.packets += 1
+            if self._dfu.received >= self._dfu.image_size:
+                self._dfu.state = None
+                self._dfu_notify(MetaWearSimulator.DFU_RESPONSE, MetaWearSimulator.DFU_RECEIVE_IMAGE, 0x01)
+            elif self._dfu_receipt_every and self._dfu.packets % self._dfu_receipt_every == 0:
+                self._dfu_notify(*(bytes([MetaWearSimulator.DFU_PACKET_RECEIPT]) + struct.pack('<I', self._dfu.received)))
+
+    def on_connection_parameters_updated(self, handler):
+        """Registers a `(float, float, int, int) -> void` handler called with the new min / max interval, latency, and timeout"""
+        self._connection_handler = handler
+
+    def _update_connection(self, min_interval, max_interval, latency, timeout):
+        # intervals are in 1.25ms units and the supervision timeout in 10ms units
+        params = (min_interval * 1.25, max_interval * 1.25, latency, timeout * 10)
+        def update():
+            self.connection_parameters = params
+            if self._connection_handler is not None:
+                self._connection_handler(*params)
+        self.schedule(update, self.connection_update_delay)
+
+    def _stream_name(self, module):
+        for name, stream in MetaWearSimulator.STREAMS.items():
+            if stream[0] == module:
+                return name
+        return None
+
+    def start_stream(self, name, **kwargs):
+        """
+        Starts emitting data notifications for a stream
+        @params:
+            name        - Required  : One of 'acc', 'gyro', 'mag', or 'fusion'
+            rate        - Optional  : Sample rate in Hz, defaults to the rate set when the simulator was created
+        """
+        module, register, generate = MetaWearSimulator.STREAMS[name]
+        rate = kwargs['rate'] if 'rate' in kwargs else self.rates[name]
+        stream = SimpleNamespace(active = True, n = 0, due = time.time())
+        self._streams[name] = stream
+
+        header = bytes([module, register])
+        def emit():
+            if not stream.active:
+                return None
+            value = header + generate(stream.n, rate if rate else 100.0)
+            stream.n += 1
+            if rate:
+                # schedule against the ideal timeline so delivery jitter does not reduce the rate
+                stream.due += 1.0 / rate
+                self.schedule(emit, max(0.0, stream.due - time.time()))
+            else:
+                self.schedule(emit)
+            return value
+        self.schedule(emit)
+
+    def stop_stream(self, name):
+        """
+        Stops emitting data notifications for a stream
+        """
+        if name in self._streams:
+            self._streams[name].active = False
+            del self._streams[name]
+
+    def add_log_entries(self, logger_id, values):
+        """
+        Queues entries that will be returned by the next log download
+        @params:
+            logger_id   - Required  : Id of the logger the entries belong to
+            values      - Required  : Iterable of 4 byte entry payloads
+        """
+        tick = self._tick()
+        for v in values:
+            self.log.append(bytes([(logger_id & 0x1f) | (self.reset_uid << 5)]) + struct.pack('<I', tick) + bytes(v))
+            tick += 1
+
+    def _readout(self, n_entries, n_notify):
+        n_entries = min(n_entries, len(self.log))
+        progress_every = max(1, n_entries // n_notify) if n_notify else 0
+        state = SimpleNamespace(left = n_entries, due = time.time())
+        header = bytes([MetaWearSimulator.LOGGING, 0x07])
+
+        def progress(left):
+            return bytes([MetaWearSimulator.LOGGING, 0x08]) + struct.pack('<I', left)
+
+        def emit():
+            entries = [self.log.popleft() for i in range(min(2, state.left))]
+            state.left -= len(entries)
+            if state.left > 0:
+                if self.log_rate:
+                    state.due += len(entries) / float(self.log_rate)
+                    self.schedule(emit, max(0.0, state.due - time.time()))
+                else:
+                    self.schedule(emit)
+                if progress_every and state.left % progress_every < len(entries):
+                    self.schedule(progress(state.left))
+            else:
+                self.schedule(progress(0))
+            return header + b''.join(entries)
+
+        if n_entries == 0:
+            self.schedule(progress(0))
+        else:
+            self.schedule(emit)
@@ -0,0 +1,120 @@
+from . import libmetawear, _value_columns, _value_types
+from .cbindings import *
+from array import array
+from ctypes import memmove
+
+import threading
+
+class SampleSink(object):
+    """
+    Data handler that copies each sample's epoch and value fields into preallocated, growable array.array columns 
+    rather than creating ctypes objects per sample.  Samples are copied with memmove, so nothing needs to be deep copied
+    """
+
+    def __init__(self, **kwargs):
+        """
+        Creates a SampleSink object
+        @params:
+            capacity    - Optional  : Number of samples to preallocate space for, defaults to 1024.  Columns double in size when full
+            fallback    - Optional  : `(POINTER(Data)) -> void` function called with the samples that cannot be stored in 
+                                      columns, e.g. byte arrays, which are otherwise only counted in skipped
+        """
+        self.capacity = kwargs['capacity'] if ('capacity' in kwargs) else 1024
+        self.fallback = kwargs['fallback'] if ('fallback' in kwargs) else None
+        self.type_id = None
+        self.fields = []
+        self.skipped = 0
+
+        self._lock = threading.Lock()
+        self._count = 0
+        self._layout = None
+        self._columns = None
+        self._targets = None
+
+        self.callback = FnVoid_VoidP_DataP(self._data_handler)
+
+    def subscribe(self, signal):
+        """
+        Subscribes the sink to a data signal
+        """
+        libmetawear.mbl_mw_datasignal_subscribe(signal, None, self.callback)
+
+    def unsubscribe(self, signal):
+        """
+        Removes the data signal's subscriber
+        """
+        libmetawear.mbl_mw_datasignal_unsubscribe(signal)
+
+    def __len__(self):
+        return self._count
+
+    def _allocate(self, capacity):
+        self._columns = [array('q', bytes(8 * capacity))] + [array(code, bytes(array(code).itemsize * capacity)) for name, code, offset in self._layout]
+        self._retarget()
+
+    def _retarget(self):
+        # buffer addresses change whenever a column is resized
+        self._epochs = self._columns[0]
+        self._targets = [(column.buffer_info()[0], column.itemsize, offset) for column, (name, code, offset) in zip(self._columns[1:], self._layout)]
+
+    def _grow(self):
+        for column in self._columns:
+            column.frombytes(bytes(column.itemsize * len(column)))
+        self._retarget()
+
+    def _set_type(self, type_id):
+        """Creates the columns for the first sample's type, returns False if the type cannot be stored in columns"""
+        if self.type_id is not None or type_id not in _value_types:
+            return False
+        layout = _value_columns(_value_types[type_id])
+        if layout is None:
+            return False
+
+        self.type_id = type_id
+        self.fields = [name for name, code, offset in layout]
+        self._layout = layout
+        self._allocate(self.capacity)
+        return True
+
+    def _data_handler(self, ctx, pointer):
+        data = pointer.contents
+        with self._lock:
+            if self.type_id == data.type_id or self._set_type(data.type_id):
+                i = self._count
+                if i == len(self._epochs):
+                    self._grow()
+                self._epochs[i] = data.epoch
+                for address, size, offset in self._targets:
+                    memmove(address + i * size, data.value + offset, size)
+                self._count = i + 1
+                return
+
+            if self.fallback is None:
+                self.skipped += 1
+                return
+        self.fallback(pointer)
+
+    def drain(self, **kwargs):
+        """
+        Removes the samples received so far from the sink and returns them as a dict of column name to array.  The epoch 
+        column is keyed with 'epoch', the remaining columns use the value type's field names, or 'value' for native types
+        @params:
+            numpy       - Optional  : Return numpy arrays that share memory with the drained columns, defaults to false
+        """
+        with self._lock:
+            if self._columns is None:
+                return {}
+            columns = self._columns
+            count = self._count
+
+            self._count = 0
+            self._allocate(self.capacity)
+
+        for column in columns:
+            del column[count:]
+
+        chunk = dict(zip(['epoch'] + self.fields, columns))
+        if 'numpy' in kwargs and kwargs['numpy']:
+            import numpy
+            chunk = dict((k, numpy.frombuffer(v, dtype = v.typecode)) for k, v in chunk.items())
+        return chunk
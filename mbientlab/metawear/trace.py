@@ -0,0 +1,179 @@
+from .metawear import MetaWear
+from .simulator import VirtualConnection
+from collections import deque
+from types import SimpleNamespace
+
+import struct
+import threading
+import time
+
+# magic, version, start time, board address
+_HEADER = struct.Struct('<4sB3xd17s')
+# seconds since start, kind, characteristic index, payload length
+_RECORD = struct.Struct('<dBBH')
+_MAGIC = b'MWTR'
+_VERSION = 1
+
+class TraceWriter(object):
+    """
+    Writes timestamped raw GATT traffic to a compact binary trace.  The file starts with a header holding the recording 
+    start time and board address, followed by records of (seconds since start, kind, characteristic index, length) and 
+    the raw payload.  Characteristic UUIDs are stored once, in a CHAR record, and referred to by index afterwards
+    """
+
+    CHAR = 0
+    WRITE = 1
+    WRITE_WITHOUT_RESPONSE = 2
+    READ = 3
+    NOTIFY = 4
+
+    def __init__(self, path, address):
+        self.path = path
+        self.start = time.time()
+        self.records = 0
+
+        self._lock = threading.Lock()
+        self._chars = {}
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, self.start, address.encode('ascii')))
+
+    def _record(self, kind, uuid, value):
+        value = bytes(value)
+        with self._lock:
+            if self._file is None:
+                return
+            elapsed = time.time() - self.start
+            if uuid not in self._chars:
+                self._chars[uuid] = len(self._chars)
+                encoded = uuid.encode('ascii')
+                self._file.write(_RECORD.pack(elapsed, TraceWriter.CHAR, self._chars[uuid], len(encoded)) + encoded)
+            self._file.write(_RECORD.pack(elapsed, kind, self._chars[uuid], len(value)) + value)
+            self.records += 1
+
+    def write(self, uuid, value, with_response):
+        self._record(TraceWriter.WRITE if with_response else TraceWriter.WRITE_WITHOUT_RESPONSE, uuid, value)
+
+    def read(self, uuid, value):
+        self._record(TraceWriter.READ, uuid, value)
+
+    def notify(self, uuid, value):
+        self._record(TraceWriter.NOTIFY, uuid, value)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class TraceReader(object):
+    """Iterates over the (seconds since start, kind, uuid, payload) records of a trace file"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._content = f.read()
+
+        if len(self._content) < _HEADER.size:
+            raise ValueError("Truncated trace '%s'" % (path))
+        magic, version, self.start, address = _HEADER.unpack_from(self._content)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("Unrecognized trace '%s'" % (path))
+        self.address = address.rstrip(b'\x00').decode('ascii')
+
+    def __iter__(self):
+        chars = {}
+        content = self._content
+        offset = _HEADER.size
+        while offset + _RECORD.size <= len(content):
+            elapsed, kind, index, length = _RECORD.unpack_from(content, offset)
+            offset += _RECORD.size
+            value = content[offset:offset + length]
+            offset += length
+            if len(value) < length:
+                return
+
+            if kind == TraceWriter.CHAR:
+                chars[index] = value.decode('ascii')
+            else:
+                yield (elapsed, kind, chars[index], value)
+
+class TraceReplay(VirtualConnection):
+    """
+    Transport that plays a recorded trace back to a MetaWear object in place of a board.  Each recorded notification is 
+    released once the host has issued as many writes as had been recorded before it, then delivered either with its 
+    original spacing scaled by `speed` or, if `speed` is None, as fast as possible.  Reads are answered with the recorded values
+    """
+
+    def __init__(self, path, **kwargs):
+        """
+        Creates a TraceReplay object
+        @params:
+            path        - Required  : Path of the trace file
+            speed       - Optional  : Playback speed relative to the recording, None replays as fast as possible.  Defaults to 1.0
+        """
+        reader = TraceReader(path)
+        VirtualConnection.__init__(self, reader.address, {})
+        self.speed = kwargs['speed'] if 'speed' in kwargs else 1.0
+
+        self._reads = {}
+        self._notifications = []
+        writes = 0
+        for elapsed, kind, uuid, value in reader:
+            if kind == TraceWriter.READ:
+                self._reads.setdefault(uuid.lower(), []).append(value)
+                if uuid.lower() in MetaWear._DEV_INFO:
+                    self.info[MetaWear._DEV_INFO[uuid.lower()]] = value.decode('utf8')
+            elif kind == TraceWriter.NOTIFY:
+                self._notifications.append((writes, elapsed, value))
+            else:
+                writes += 1
+
+        self._lock = threading.Lock()
+        self._pending_reads = {}
+        self._writes = 0
+        self._next = 0
+        self._clock = None
+
+    @property
+    def finished(self):
+        """
+        True once every recorded notification has been released
+        """
+        return self._next == len(self._notifications)
+
+    def _on_connect(self):
+        with self._lock:
+            self._pending_reads = dict((k, deque(v)) for k, v in self._reads.items())
+            self._writes = 0
+            self._next = 0
+            self._clock = None
+        self._release()
+
+    def _received(self, value):
+        with self._lock:
+            self._writes += 1
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            now = time.time()
+            while self._next < len(self._notifications) and self._notifications[self._next][0] <= self._writes:
+                writes, elapsed, value = self._notifications[self._next]
+                if self.speed is None or self._clock is None:
+                    due = now
+                else:
+                    due = max(now, self._clock[0] + (elapsed - self._clock[1]) / self.speed)
+                self._clock = (due, elapsed)
+                self.schedule(value, due - now)
+                self._next += 1
+
+    def _read(self, uuid, handler):
+        # the last recorded value keeps being returned once the recorded reads run out
+        with self._lock:
+            pending = self._pending_reads[uuid]
+            value = pending.popleft() if len(pending) > 1 else pending[0]
+        handler(value, None)
+
+    def find_characteristic(self, uuid):
+        if uuid.lower() in self._reads:
+            return SimpleNamespace(read_value_async = lambda handler: self._read(uuid.lower(), handler))
+        return VirtualConnection.find_characteristic(self, uuid)